@@ -9,6 +9,8 @@ from posts.models import Post, Group
 def mock_media(settings):
     with tempfile.TemporaryDirectory() as temp_directory:
         settings.MEDIA_ROOT = temp_directory
+        # Миниатюры создаются в запросе, пока временная папка ещё есть.
+        settings.THUMBNAIL_WORKERS = 0
         yield temp_directory
 
 
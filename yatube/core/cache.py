@@ -0,0 +1,178 @@
+"""Кеширование страниц с версиями вместо короткого TTL.
+
+Ключ страницы включает версии пространств имён, от которых она зависит
+(например, 'index' или 'group:<slug>'). Сигналы увеличивают версию при
+изменении данных, и следующий запрос рендерит страницу заново.
+
+Запись хранится вместе с версиями и временем свежести (soft TTL), а живёт
+в кеше до hard TTL. Устаревшую запись пересчитывает один запрос, который
+взял блокировку, остальные в это время получают старую копию. Если копии
+нет, остальные ждут пересчёта не дольше lock_timeout.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from . import replica
+from .holes import fill_holes
+
+
+# Версия, от которой зависят все страницы: переименование автора,
+# изменение или удаление группы.
+SITE = 'site'
+
+WAIT_INTERVAL = 0.05
+
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+
+
+def record(event):
+    with _metrics_lock:
+        _metrics[event] += 1
+
+
+def page_cache_metrics():
+    """Счётчики процесса: hit, stale, recompute, wait."""
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def version_key(namespace):
+    return f'page_version:{namespace}'
+
+
+def get_versions(namespaces):
+    """Текущие версии пространств имён одним обращением к кешу."""
+    keys = [version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Версия могла быть вытеснена из кеша. Начинаем её с текущего
+            # времени, чтобы не совпасть с давно закешированной страницей.
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(version_key(namespace))
+        except ValueError:
+            get_versions([namespace])
+
+
+def page_key(request):
+    path = request.get_full_path()
+    return 'page:' + hashlib.md5(path.encode()).hexdigest()
+
+
+def get_or_recompute(key, versions, compute, soft_timeout, hard_timeout,
+                     lock_timeout):
+    """Значение из кеша с защитой от одновременного пересчёта.
+
+    compute возвращает пару (значение, можно ли его кешировать).
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        entry_versions, fresh_until, value = entry
+        if entry_versions == versions and fresh_until > time.time():
+            record('hit')
+            return value
+    lock_key = f'{key}:lock'
+    deadline = time.time() + lock_timeout
+    locked = cache.add(lock_key, 1, lock_timeout)
+    while not locked:
+        if entry is not None:
+            record('stale')
+            return entry[2]
+        if time.time() >= deadline:
+            break
+        record('wait')
+        time.sleep(WAIT_INTERVAL)
+        fresh = cache.get(key)
+        if fresh is not None and fresh[0] == versions:
+            record('hit')
+            return fresh[2]
+        locked = cache.add(lock_key, 1, lock_timeout)
+    try:
+        record('recompute')
+        value, cacheable = compute()
+        if cacheable:
+            cache.set(
+                key, (versions, time.time() + soft_timeout, value),
+                hard_timeout,
+            )
+        return value
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def punch_holes(response, request):
+    """Копия закешированного каркаса с фрагментами для request.user."""
+    content = fill_holes(response.content.decode(response.charset), request)
+    filled = HttpResponse(content, status=response.status_code)
+    for header, value in response.items():
+        if header != 'Content-Length':
+            filled[header] = value
+    return filled
+
+
+def versioned_cache_page(namespaces=None, soft_timeout=None,
+                         hard_timeout=None, lock_timeout=None, holes=False):
+    """Кеширует ответ, заменяет cache_page.
+
+    namespaces получает аргументы представления и возвращает список
+    пространств имён, версии которых сверяются с записью в кеше.
+
+    Без holes кешируются только ответы анонимным пользователям. С holes
+    страница рендерится как общий каркас с маркерами вместо тегов
+    {% hole %}, а маркеры заполняются для каждого запроса, так что кеш
+    работает и для авторизованных пользователей.
+
+    Запросы, закреплённые за основной базой (core.replica), кеш обходят.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated and not holes
+                    or replica.pinned()):
+                return view(request, *args, **kwargs)
+            names = [SITE]
+            if namespaces is not None:
+                names += namespaces(*args, **kwargs)
+
+            def compute():
+                request.page_skeleton = holes
+                try:
+                    response = view(request, *args, **kwargs)
+                finally:
+                    request.page_skeleton = False
+                # Запись во время рендера тоже закрепляет запрос.
+                return response, (
+                    response.status_code == 200 and not response.streaming
+                    and not replica.pinned()
+                )
+
+            response = get_or_recompute(
+                page_key(request),
+                get_versions(names),
+                compute,
+                soft_timeout or settings.PAGE_CACHE_SOFT_TIMEOUT,
+                hard_timeout or settings.PAGE_CACHE_TIMEOUT,
+                lock_timeout or settings.PAGE_CACHE_LOCK_TIMEOUT,
+            )
+            if holes and not response.streaming:
+                return punch_holes(response, request)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,323 @@
+"""Бэкенды кеша для нескольких процессов на одной машине.
+
+SQLiteCache хранит записи в файле SQLite, общем для всех воркеров.
+TwoTierCache держит перед ним LocMemCache (L1) в памяти процесса. Запись
+и удаление ключа пишут его в журнал инвалидации в том же файле; каждый
+процесс не реже POLL_INTERVAL секунд читает журнал и выкидывает из L1
+изменённые другими процессами ключи.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache_backends.TwoTierCache',
+            'LOCATION': '/var/tmp/yatube-cache.sqlite3',
+            'OPTIONS': {'L1_TIMEOUT': 5, 'POLL_INTERVAL': 0.5},
+        }
+    }
+"""
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def raw_key(key, key_prefix, version):
+    """Ключ уже собран TwoTierCache, уровням его менять не нужно."""
+    return key
+
+
+# Специальный ключ журнала: очистить L1 целиком.
+CLEAR_ALL = '*'
+
+
+class SQLiteCache(BaseCache):
+    """Кеш в файле SQLite, общий для процессов одной машины."""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        self.journal_ttl = params.get('OPTIONS', {}).get('JOURNAL_TTL', 60)
+        self._local = threading.local()
+        self._sets = 0
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB, expires REAL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS invalidations ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, '
+                'created REAL)'
+            )
+            self._local.connection = conn
+        return conn
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _select(self, key):
+        row = self.connection.execute(
+            'SELECT value, expires FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires <= time.time():
+            return None
+        return row
+
+    def get(self, key, default=None, version=None):
+        row = self._select(self._key(key, version))
+        return default if row is None else pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        made = {self._key(key, version): key for key in keys}
+        if not made:
+            return {}
+        rows = self.connection.execute(
+            'SELECT key, value FROM cache WHERE key IN (%s) '
+            'AND (expires IS NULL OR expires > ?)'
+            % ', '.join('?' * len(made)),
+            (*made, time.time()),
+        )
+        return {made[key]: pickle.loads(value) for key, value in rows}
+
+    def _write(self, sql, key, value, timeout):
+        expires = self.get_backend_timeout(timeout)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        cursor = self.connection.execute(sql, (key, value, expires))
+        self._sets += 1
+        if self._cull_frequency and self._sets % 100 == 0:
+            self._cull()
+        return cursor.rowcount
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write(
+            'INSERT OR REPLACE INTO cache (key, value, expires) '
+            'VALUES (?, ?, ?)',
+            self._key(key, version), value, timeout,
+        )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (key, time.time()),
+            )
+            added = self._write(
+                'INSERT OR IGNORE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                key, value, timeout,
+            )
+        finally:
+            conn.execute('COMMIT')
+        return bool(added)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self.connection.execute(
+            'UPDATE cache SET expires = ? WHERE key = ?',
+            (self.get_backend_timeout(timeout), self._key(key, version)),
+        )
+        return bool(cursor.rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._select(key)
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            conn.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key),
+            )
+        finally:
+            conn.execute('COMMIT')
+        return value
+
+    def delete(self, key, version=None):
+        self.connection.execute(
+            'DELETE FROM cache WHERE key = ?', (self._key(key, version),)
+        )
+
+    def has_key(self, key, version=None):
+        return self._select(self._key(key, version)) is not None
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
+
+    def _cull(self):
+        conn = self.connection
+        now = time.time()
+        conn.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        conn.execute(
+            'DELETE FROM invalidations WHERE created < ?',
+            (now - self.journal_ttl,),
+        )
+        count = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries:
+            conn.execute(
+                # NULL в SQLite сортируется первым, а вечные записи (версии
+                # страниц) должны вытесняться последними.
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency,),
+            )
+
+    def publish(self, key):
+        """Записывает ключ в журнал инвалидации."""
+        self.connection.execute(
+            'INSERT INTO invalidations (key, created) VALUES (?, ?)',
+            (key, time.time()),
+        )
+
+    def invalidations_since(self, last_id):
+        """Ключи из журнала после last_id и признак пропуска записей."""
+        conn = self.connection
+        if last_id is None:
+            row = conn.execute('SELECT MAX(id) FROM invalidations').fetchone()
+            return row[0] or 0, [], False
+        rows = conn.execute(
+            'SELECT id, key FROM invalidations WHERE id > ? ORDER BY id',
+            (last_id,),
+        ).fetchall()
+        if not rows:
+            return last_id, [], False
+        # Записи после last_id могли быть удалены при чистке журнала.
+        gap = rows[0][0] != last_id + 1
+        return rows[-1][0], [key for _, key in rows], gap
+
+
+class TwoTierCache(BaseCache):
+    """LocMemCache процесса перед общим SQLiteCache."""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l1_timeout = options.get('L1_TIMEOUT', 5)
+        self.poll_interval = options.get('POLL_INTERVAL', 0.5)
+        tier_params = {
+            'TIMEOUT': params.get('TIMEOUT', 300),
+            'KEY_FUNCTION': raw_key,
+            'OPTIONS': {
+                key: value for key, value in options.items()
+                if key in ('MAX_ENTRIES', 'CULL_FREQUENCY', 'JOURNAL_TTL')
+            },
+        }
+        self.l1 = LocMemCache(f'two-tier:{location}', tier_params)
+        self.l2 = SQLiteCache(location, tier_params)
+        self._last_id = None
+        self._polled = 0
+        self._poll_lock = threading.Lock()
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _l1_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def sync(self):
+        """Выкидывает из L1 ключи, изменённые другими процессами."""
+        now = time.monotonic()
+        if now - self._polled < self.poll_interval:
+            return
+        with self._poll_lock:
+            self._polled = now
+            self._last_id, keys, gap = self.l2.invalidations_since(
+                self._last_id
+            )
+            if gap or CLEAR_ALL in keys:
+                self.l1.clear()
+            else:
+                self.l1.delete_many(keys)
+
+    def _changed(self, key):
+        self.l1.delete(key)
+        self.l2.publish(key)
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        self.sync()
+        sentinel = object()
+        value = self.l1.get(key, sentinel)
+        if value is sentinel:
+            value = self.l2.get(key, sentinel)
+            if value is sentinel:
+                return default
+            self.l1.set(key, value, self.l1_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        made = {self._key(key, version): key for key in keys}
+        self.sync()
+        found = self.l1.get_many(made)
+        missing = [key for key in made if key not in found]
+        if missing:
+            from_l2 = self.l2.get_many(missing)
+            self.l1.set_many(from_l2, self.l1_timeout)
+            found.update(from_l2)
+        return {made[key]: value for key, value in found.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self.l2.set(key, value, timeout)
+        self._changed(key)
+        self.l1.set(key, value, self._l1_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        if not self.l2.add(key, value, timeout):
+            return False
+        self._changed(key)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self.l1.delete(key)
+        return self.l2.touch(key, timeout)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        value = self.l2.incr(key, delta)
+        self._changed(key)
+        return value
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        self.l2.delete(key)
+        self._changed(key)
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        self.sync()
+        return self.l1.has_key(key) or self.l2.has_key(key)
+
+    def clear(self):
+        self.l2.clear()
+        self.l1.clear()
+        self.l2.publish(CLEAR_ALL)
@@ -0,0 +1,61 @@
+"""Бэкенд SQLite с настройками для нескольких воркеров.
+
+Каждое новое соединение получает PRAGMA из OPTIONS['pragmas'] поверх
+PRAGMAS: журнал WAL (читатели не ждут писателя), synchronous=NORMAL
+(в режиме WAL достаточно для целостности), ожидание блокировки вместо
+мгновенной ошибки, mmap и кеш страниц побольше.
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'core.db_backend',
+            'NAME': 'db.sqlite3',
+            'CONN_MAX_AGE': 600,
+            'OPTIONS': {'pragmas': {'mmap_size': 2 ** 30}},
+        }
+    }
+
+Соединения живут между запросами (CONN_MAX_AGE); после ошибки Django
+проверяет их is_usable и закрывает сломанные.
+"""
+from django.db.backends.sqlite3 import base
+
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    # Отрицательное значение — размер в КиБ, а не в страницах.
+    'cache_size': -64000,
+    'mmap_size': 256 * 2 ** 20,
+    'temp_store': 'MEMORY',
+}
+
+
+def apply_pragmas(connection, pragmas):
+    for name, value in pragmas.items():
+        connection.execute(f'PRAGMA {name} = {value}')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = {**PRAGMAS, **options.get('pragmas', {})}
+        self.settings_dict['OPTIONS'] = {
+            key: value for key, value in options.items() if key != 'pragmas'
+        }
+        try:
+            return super().get_connection_params()
+        finally:
+            self.settings_dict['OPTIONS'] = options
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        apply_pragmas(connection, self.pragmas)
+        return connection
+
+    def is_usable(self):
+        try:
+            self.connection.execute('SELECT 1')
+        except base.Database.Error:
+            return False
+        return True
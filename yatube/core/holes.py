@@ -0,0 +1,47 @@
+"""Персональные вставки («дырки») в закешированных страницах.
+
+Страница с дырками рендерится один раз как общий для всех каркас: вместо
+персональных частей тег {% hole %} оставляет маркер. При каждом ответе
+fill_holes заменяет маркеры фрагментами, отрендеренными для текущего
+пользователя, поэтому каркас можно отдавать и авторизованным.
+"""
+import re
+from urllib.parse import quote, unquote
+
+from django.template.loader import render_to_string
+
+
+MARKER_RE = re.compile(r'<!--hole:([\w-]+):([^>]*)-->')
+
+_renderers = {}
+
+
+def register(name):
+    """Регистрирует функцию renderer(request, *args) -> str."""
+    def decorator(renderer):
+        _renderers[name] = renderer
+        return renderer
+    return decorator
+
+
+def marker(name, args):
+    encoded = ','.join(quote(str(arg), safe='') for arg in args)
+    return f'<!--hole:{name}:{encoded}-->'
+
+
+def render(name, request, args):
+    return _renderers[name](request, *args)
+
+
+def fill_holes(content, request):
+    """Заменяет маркеры в каркасе фрагментами для request.user."""
+    def replace(match):
+        name, encoded = match.groups()
+        args = [unquote(arg) for arg in encoded.split(',')] if encoded else []
+        return render(name, request, args)
+    return MARKER_RE.sub(replace, content)
+
+
+@register('header')
+def header(request):
+    return render_to_string('includes/header.html', request=request)
@@ -0,0 +1,50 @@
+"""Отдельная база для таблиц с частыми мелкими записями.
+
+Комментарии и подписки пишутся часто и небольшими порциями. В одной
+базе с остальными таблицами они стоят в очереди за той же блокировкой
+записи SQLite, поэтому модели из HOT_MODELS ('приложение.модель')
+живут в базе HOT_DATABASE. Включается путём к файлу в
+DJANGO_HOT_DATABASE; таблицы создаются командой
+
+    python manage.py migrate --database hot
+
+Имеющиеся строки переносятся через dumpdata posts.comment posts.follow
+и loaddata --database hot.
+
+Запросов с JOIN между базами не бывает: код, которому нужны данные
+обеих, сначала выбирает id из одной, а потом объекты из другой.
+"""
+from django.conf import settings
+
+
+def is_hot(model):
+    # Исторические модели миграций (модуль __fake__) работают с базой,
+    # к которой применяется миграция.
+    return (
+        model._meta.label_lower in settings.HOT_MODELS
+        and model.__module__ != '__fake__'
+    )
+
+
+class HotTablesRouter:
+    def db_for_read(self, model, **hints):
+        if is_hot(model):
+            return settings.HOT_DATABASE
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if settings.HOT_DATABASE in (obj1._state.db, obj2._state.db):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # В основной базе схема остаётся полной, чтобы старые миграции
+        # данных и выключение отдельной базы работали без переделок.
+        if db == settings.HOT_DATABASE:
+            return (
+                model_name is not None
+                and f'{app_label}.{model_name}' in settings.HOT_MODELS
+            )
+        return None
@@ -0,0 +1,136 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.db_backend.base import PRAGMAS, apply_pragmas
+
+
+def connect(path, pragmas):
+    connection = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(connection, pragmas)
+    return connection
+
+
+def prepare(path, pragmas, rows, authors):
+    connection = connect(path, pragmas)
+    connection.execute(
+        'CREATE TABLE post (id INTEGER PRIMARY KEY, author_id INTEGER, '
+        'text TEXT)'
+    )
+    connection.execute('CREATE INDEX post_author ON post (author_id, id)')
+    connection.executemany(
+        'INSERT INTO post (author_id, text) VALUES (?, ?)',
+        ((random.randrange(authors), 'x' * 200) for _ in range(rows)),
+    )
+    connection.close()
+
+
+class Worker(threading.Thread):
+    """Повторяет один «запрос», пока не выйдет время."""
+
+    def __init__(self, path, pragmas, persistent, write, authors, deadline):
+        super().__init__(daemon=True)
+        self.path, self.pragmas = path, pragmas
+        self.persistent, self.write = persistent, write
+        self.authors, self.deadline = authors, deadline
+        self.done = self.locked = 0
+
+    def request(self, connection):
+        author = random.randrange(self.authors)
+        if self.write:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'INSERT INTO post (author_id, text) VALUES (?, ?)',
+                (author, 'x' * 200),
+            )
+            connection.execute('COMMIT')
+        else:
+            connection.execute(
+                'SELECT id, text FROM post WHERE author_id = ? '
+                'ORDER BY id DESC LIMIT 10', (author,)
+            ).fetchall()
+
+    def run(self):
+        connection = None
+        while time.monotonic() < self.deadline:
+            if connection is None:
+                connection = connect(self.path, self.pragmas)
+            try:
+                self.request(connection)
+                self.done += 1
+            except sqlite3.OperationalError:
+                self.locked += 1
+                if connection.in_transaction:
+                    connection.execute('ROLLBACK')
+            if not self.persistent:
+                # Как при CONN_MAX_AGE = 0: соединение на каждый запрос.
+                connection.close()
+                connection = None
+        if connection is not None:
+            connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает SQLite по умолчанию и с настройками core.db_backend '
+        'при параллельных чтениях и записях.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--readers', type=int, default=4,
+            help='Сколько потоков читают.',
+        )
+        parser.add_argument(
+            '--writers', type=int, default=2,
+            help='Сколько потоков пишут.',
+        )
+        parser.add_argument(
+            '--duration', type=float, default=5,
+            help='Сколько секунд длится каждый прогон.',
+        )
+        parser.add_argument(
+            '--rows', type=int, default=20000,
+            help='Сколько статей в базе перед прогоном.',
+        )
+
+    def handle(self, *args, **options):
+        profiles = (
+            ('По умолчанию', {}, False),
+            ('WAL и постоянные соединения', PRAGMAS, True),
+        )
+        for label, pragmas, persistent in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'benchmark.sqlite3')
+                prepare(path, pragmas, options['rows'], authors=100)
+                workers = self.run(path, pragmas, persistent, options)
+            self.report(label, workers, options['duration'])
+
+    def run(self, path, pragmas, persistent, options):
+        deadline = time.monotonic() + options['duration']
+        workers = [
+            Worker(path, pragmas, persistent, write, 100, deadline)
+            for write in (
+                [False] * options['readers'] + [True] * options['writers']
+            )
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return workers
+
+    def report(self, label, workers, duration):
+        reads = sum(worker.done for worker in workers if not worker.write)
+        writes = sum(worker.done for worker in workers if worker.write)
+        locked = sum(worker.locked for worker in workers)
+        self.stdout.write(
+            f'{label}: чтений {reads / duration:.0f}/с, '
+            f'записей {writes / duration:.0f}/с, '
+            f'ошибок блокировки {locked}'
+        )
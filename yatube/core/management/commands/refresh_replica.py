@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import replica
+from core.cache import SITE, bump_versions
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную базу в реплику для чтения.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Повторять каждые столько секунд; 0 — скопировать один '
+                 'раз.',
+        )
+
+    def handle(self, *args, **options):
+        if settings.REPLICA_DATABASE not in settings.DATABASES:
+            raise CommandError(
+                'Реплика не настроена: задайте DJANGO_READ_REPLICA.'
+            )
+        while True:
+            started = time.monotonic()
+            replica.refresh()
+            # Страницы в кеше могли быть собраны из прежней копии.
+            bump_versions(SITE)
+            self.stdout.write(
+                f'Реплика обновлена за {time.monotonic() - started:.2f} с'
+            )
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
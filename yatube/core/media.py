@@ -0,0 +1,138 @@
+"""Раздача загруженных файлов, когда DEBUG выключен.
+
+Картинки статей и миниатюры sorl лежат под именами из хеша (см.
+core.storage), файл под таким именем никогда не меняется, поэтому
+браузер может кешировать его навсегда (MEDIA_IMMUTABLE_PREFIXES).
+Остальные файлы кешируются на MEDIA_CACHE_MAX_AGE и проверяются по ETag.
+
+Поддерживается один диапазон Range (и If-Range) — этого хватает
+браузерам и докачке. Если задан MEDIA_ACCEL_REDIRECT, файл отдаёт
+фронтовой nginx через X-Accel-Redirect, а от Django идут только
+заголовки; диапазоны nginx тогда обрабатывает сам.
+"""
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified,
+    StreamingHttpResponse)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+BLOCK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """(начало, конец включительно) единственного диапазона.
+
+    None — заголовка нет или его нельзя разобрать, тогда отдаётся весь
+    файл; ValueError — диапазон за пределами файла.
+    """
+    match = RANGE_RE.match(header or '')
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-N: последние N байт.
+        length = int(last)
+        if length == 0 or size == 0:
+            # В пустом файле нет ни одного байта для диапазона.
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        raise ValueError(header)
+    return first, last
+
+
+def read_range(path, first, last):
+    with open(path, 'rb') as file:
+        file.seek(first)
+        remaining = last - first + 1
+        while remaining:
+            chunk = file.read(min(BLOCK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def cache_control(name):
+    if name.startswith(tuple(settings.MEDIA_IMMUTABLE_PREFIXES)):
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+
+@require_safe
+def serve(request, path):
+    # Служебные каталоги вроде .incoming наружу не отдаются.
+    if any(part.startswith('.') for part in path.split('/')):
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        file_stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404
+    size = file_stat.st_size
+    etag = f'"{file_stat.st_mtime_ns:x}-{size:x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(file_stat.st_mtime),
+        'Cache-Control': cache_control(path),
+    }
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (
+            if_none_match.strip() == '*'
+            or etag in parse_etags(if_none_match)):
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_ACCEL_REDIRECT:
+        response = HttpResponse(
+            content_type=mimetypes.guess_type(path)[0]
+            or 'application/octet-stream'
+        )
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_ACCEL_REDIRECT + quote(path)
+        )
+    else:
+        response = file_response(request, full_path, size, etag)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def file_response(request, full_path, size, etag):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    byte_range = None
+    if not if_range or if_range == etag:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+    if byte_range is None:
+        # Целиком файл отдаётся через wsgi.file_wrapper (sendfile).
+        response = FileResponse(open(full_path, 'rb'))
+    else:
+        first, last = byte_range
+        response = StreamingHttpResponse(
+            read_range(full_path, first, last), status=206,
+            content_type=mimetypes.guess_type(full_path)[0]
+            or 'application/octet-stream',
+        )
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
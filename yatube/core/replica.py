@@ -0,0 +1,112 @@
+"""Локальная реплика базы для чтения лент и статей.
+
+Чтения моделей из REPLICA_APPS во время запроса идут в базу
+REPLICA_DATABASE — копию основной, которую команда refresh_replica
+обновляет через backup API SQLite. Запись всегда идёт в основную базу.
+
+Реплика отстаёт, поэтому после записи (статья, комментарий, подписка)
+пользователь до конца запроса и ещё REPLICA_STICKY_SECONDS секунд
+читает из основной базы: это отмечает кука REPLICA_COOKIE. Вне запросов
+(команды, фоновые потоки) и внутри транзакций чтения идут в основную.
+
+Запросы, кроме GET, HEAD и OPTIONS, целиком читают из основной базы:
+прочитанное ими обычно тут же записывается обратно, и устаревшая строка
+из реплики затёрла бы свежие данные. Вью, чьи GET-ответы ложатся в
+следующую запись (форма правки, статус загрузки), отмечаются
+декоратором use_primary.
+
+Такие запросы не читают и не пишут кеш страниц (core.cache): иначе автор
+увидел бы страницу без своей записи, а страница, собранная из реплики,
+легла бы в кеш под уже новой версией. Команда refresh_replica после
+копирования увеличивает версию SITE, так что страницы, собранные из
+старой копии, пересчитываются.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICA_COOKIE = 'replica_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = threading.local()
+
+
+def replica_path():
+    return settings.DATABASES[settings.REPLICA_DATABASE]['NAME']
+
+
+def refresh(source=None, target=None):
+    """Копирует основную базу в реплику одним шагом backup."""
+    source = source or settings.DATABASES[DEFAULT_DB_ALIAS]['NAME']
+    target = target or replica_path()
+    with closing(sqlite3.connect(source)) as source_connection, \
+            closing(sqlite3.connect(target, timeout=30)) as target_connection:
+        source_connection.backup(target_connection)
+
+
+def pinned():
+    """Читает ли текущий запрос из основной базы в обход реплики."""
+    return getattr(_state, 'pinned', False)
+
+
+def use_primary(view):
+    """Декоратор вью: все её чтения идут в основную базу."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        _state.pinned = True
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (model._meta.app_label in settings.REPLICA_APPS
+                and getattr(_state, 'active', False)
+                and not getattr(_state, 'pinned', False)
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return settings.REPLICA_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label in settings.REPLICA_APPS:
+            _state.pinned = _state.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == settings.REPLICA_DATABASE:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Пока реплику ни разу не скопировали, читаем из основной базы.
+        _state.active = os.path.exists(replica_path())
+        _state.pinned = (
+            request.method not in SAFE_METHODS
+            or REPLICA_COOKIE in request.COOKIES
+        )
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = _state.wrote
+            _state.active = _state.pinned = _state.wrote = False
+        if wrote:
+            response.set_cookie(
+                REPLICA_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
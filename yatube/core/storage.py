@@ -0,0 +1,82 @@
+"""Хранилище файлов с адресацией по содержимому.
+
+Файл сохраняется под именем <каталог>/ab/cd/<sha256><расширение>, где
+каталог берётся из исходного имени (upload_to поля). Хеш считается, пока
+загрузка копируется во временный файл, так что одинаковые файлы занимают
+на диске одно место, а ни в одном каталоге не скапливаются миллионы
+записей. Файлы, на которые ещё ссылаются, удалять нельзя: за ссылками
+следит модель, которая пользуется хранилищем.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+# Каталог для недописанных загрузок внутри MEDIA_ROOT.
+INCOMING_DIR = '.incoming'
+
+
+def hashed_name(directory, digest, extension):
+    return '/'.join(filter(None, (
+        directory, digest[:2], digest[2:4], digest + extension.lower()
+    )))
+
+
+def walk(storage, path=''):
+    """Имена всех файлов под path, без служебных каталогов и файлов."""
+    directories, files = storage.listdir(path)
+    for name in sorted(files):
+        if not name.startswith('.'):
+            yield f'{path}/{name}' if path else name
+    for directory in sorted(directories):
+        if not directory.startswith('.'):
+            yield from walk(
+                storage, f'{path}/{directory}' if path else directory
+            )
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Имя всё равно заменяется хешем содержимого в _save.
+        return name
+
+    def content_name(self, name, digest):
+        """Имя, под которым сохранится файл с данным SHA-256."""
+        directory, basename = os.path.split(name)
+        return hashed_name(directory, digest, os.path.splitext(basename)[1])
+
+    def _save(self, name, content):
+        incoming = self.path(INCOMING_DIR)
+        os.makedirs(incoming, exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=incoming, delete=False) as temp:
+            try:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+            except Exception:
+                os.unlink(temp.name)
+                raise
+        name = self.content_name(name, digest.hexdigest())
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            try:
+                # Свежее время изменения защищает файл от
+                # collect_media_garbage (--min-age), пока ссылающаяся
+                # статья не сохранена.
+                os.utime(full_path)
+            except FileNotFoundError:
+                # Файл удалили после проверки: записываем заново.
+                pass
+            else:
+                os.unlink(temp.name)
+                return name
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # NamedTemporaryFile создаётся с правами 0600.
+        os.chmod(temp.name, self.file_permissions_mode or 0o644)
+        os.replace(temp.name, full_path)
+        return name
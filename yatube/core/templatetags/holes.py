@@ -0,0 +1,15 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from core import holes
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name, *args):
+    """Персональный фрагмент или маркер на его месте в каркасе."""
+    request = context.get('request')
+    if getattr(request, 'page_skeleton', False):
+        return mark_safe(holes.marker(name, args))
+    return mark_safe(holes.render(name, request, args))
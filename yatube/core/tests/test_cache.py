@@ -0,0 +1,52 @@
+import time
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from core.cache import get_or_recompute, page_cache_metrics
+
+
+class StaleWhileRevalidateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return f'страница {self.calls}', True
+
+    def get(self, versions=(1,), soft_timeout=60, lock_timeout=1):
+        return get_or_recompute(
+            'page:test', list(versions), self.compute,
+            soft_timeout, 600, lock_timeout,
+        )
+
+    def test_fresh_entry_is_served_from_cache(self):
+        """Свежая запись отдаётся без пересчёта."""
+        self.assertEqual(self.get(), 'страница 1')
+        self.assertEqual(self.get(), 'страница 1')
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_entry_served_while_other_request_recomputes(self):
+        """Пока пересчёт занят другим запросом, отдаётся старая копия."""
+        self.get()
+        cache.add('page:test:lock', 1)
+        hits_before = page_cache_metrics().get('stale', 0)
+        self.assertEqual(self.get(versions=(2,)), 'страница 1')
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(page_cache_metrics()['stale'], hits_before + 1)
+        cache.delete('page:test:lock')
+        self.assertEqual(self.get(versions=(2,)), 'страница 2')
+
+    def test_soft_timeout_triggers_single_recompute(self):
+        """После soft TTL запись пересчитывается."""
+        self.get(soft_timeout=0.01)
+        time.sleep(0.02)
+        self.assertEqual(self.get(), 'страница 2')
+
+    def test_waiter_recomputes_after_lock_timeout(self):
+        """Без копии запрос ждёт блокировку не дольше lock_timeout."""
+        cache.add('page:test:lock', 1)
+        started = time.time()
+        self.assertEqual(self.get(lock_timeout=0.1), 'страница 1')
+        self.assertLess(time.time() - started, 1)
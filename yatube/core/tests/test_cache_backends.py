@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import SimpleTestCase
+
+from core.cache_backends import SQLiteCache, TwoTierCache
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'cache.sqlite3')
+        params = {'OPTIONS': {'POLL_INTERVAL': 0, 'L1_TIMEOUT': 60}}
+        # Два экземпляра на одном файле ведут себя как два воркера.
+        self.first = TwoTierCache(path, params)
+        self.second = TwoTierCache(path, params)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_value_is_shared_between_workers(self):
+        """Значение, записанное одним процессом, видно другому."""
+        self.first.set('key', {'a': 1})
+        self.assertEqual(self.second.get('key'), {'a': 1})
+        self.assertEqual(self.second.get_many(['key', 'missing']),
+                         {'key': {'a': 1}})
+
+    def test_set_and_delete_evict_other_workers_l1(self):
+        """Запись и удаление в одном процессе сбрасывают L1 в другом."""
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+    def test_incr_and_add_are_shared(self):
+        """incr и add работают по общему хранилищу."""
+        self.assertTrue(self.first.add('counter', 1))
+        self.assertFalse(self.second.add('counter', 5))
+        self.assertEqual(self.second.get('counter'), 1)
+        self.assertEqual(self.first.incr('counter'), 2)
+        self.assertEqual(self.second.get('counter'), 2)
+        with self.assertRaises(ValueError):
+            self.first.incr('missing')
+
+    def test_clear_empties_all_workers(self):
+        """clear очищает L1 во всех процессах."""
+        self.first.set('key', 'value')
+        self.second.get('key')
+        self.first.clear()
+        self.assertIsNone(self.second.get('key'))
+
+    def test_expired_entries_are_not_returned(self):
+        """Истёкшие записи не возвращаются."""
+        cache = SQLiteCache(os.path.join(self.directory, 'l2.sqlite3'), {})
+        cache.set('key', 'value', 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('key'))
+        self.assertTrue(cache.add('key', 'again'))
+        self.assertEqual(cache.get('key'), 'again')
+
+    def test_cull_keeps_entries_without_expiry(self):
+        """При вытеснении вечные записи уходят последними."""
+        cache = SQLiteCache(
+            os.path.join(self.directory, 'l2.sqlite3'),
+            {'OPTIONS': {'MAX_ENTRIES': 4, 'CULL_FREQUENCY': 2}},
+        )
+        cache.set('page_version:index', 1, None)
+        for i in range(5):
+            cache.set(f'page:{i}', i, 60)
+        cache._cull()
+        self.assertEqual(cache.get('page_version:index'), 1)
+        self.assertIsNone(cache.get('page:0'))
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase
+
+from core.db_backend.base import DatabaseWrapper
+
+
+class DatabaseBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.wrapper = DatabaseWrapper({
+            **connection.settings_dict,
+            'NAME': os.path.join(self.directory, 'db.sqlite3'),
+            'OPTIONS': {'pragmas': {'cache_size': -1000}},
+        })
+
+    def tearDown(self):
+        self.wrapper.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def pragma(self, name):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_new_connection_gets_pragmas(self):
+        """Новое соединение работает в WAL с PRAGMA из настроек."""
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -1000)
+        self.assertNotIn('pragmas', self.wrapper.get_connection_params())
+
+    def test_closed_connection_is_not_usable(self):
+        """Сломанное соединение не проходит проверку is_usable."""
+        self.wrapper.ensure_connection()
+        self.assertTrue(self.wrapper.is_usable())
+        self.wrapper.connection.close()
+        self.assertFalse(self.wrapper.is_usable())
+
+    def test_benchmark_reports_both_profiles(self):
+        """Бенчмарк печатает по строке на каждый профиль."""
+        out = StringIO()
+        call_command(
+            'benchmark_database', duration=0.2, rows=100, readers=1,
+            writers=1, stdout=out,
+        )
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
@@ -0,0 +1,90 @@
+from unittest import skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import Client, SimpleTestCase, TransactionTestCase
+from django.urls import reverse
+
+from core.hot import HotTablesRouter
+from posts.models import Comment, Follow, Post, User, UserStats
+
+
+class HotTablesRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = HotTablesRouter()
+
+    def test_hot_models_use_own_database(self):
+        """Комментарии и подписки читаются и пишутся в базу hot."""
+        for model, database in ((Comment, 'hot'), (Follow, 'hot'),
+                                (Post, None), (User, None)):
+            with self.subTest(model=model.__name__):
+                self.assertEqual(self.router.db_for_read(model), database)
+                self.assertEqual(self.router.db_for_write(model), database)
+
+    def test_migrations_are_split(self):
+        """В базе hot создаются только её таблицы, в основной — все."""
+        for db, args, allowed in (
+                ('hot', ('posts', 'comment'), True),
+                ('hot', ('posts', 'post'), False),
+                ('hot', ('auth', 'user'), False),
+                ('hot', ('posts',), False),
+                ('default', ('posts', 'follow'), None),
+                ('default', ('posts', 'post'), None),
+                ('default', ('posts',), None)):
+            with self.subTest(db=db, args=args):
+                self.assertIs(
+                    self.router.allow_migrate(db, *args), allowed)
+
+    def test_relations_across_databases_are_allowed(self):
+        """Комментарий из hot может ссылаться на статью из основной базы."""
+        comment, post = Comment(), Post()
+        comment._state.db, post._state.db = 'hot', 'default'
+        self.assertTrue(self.router.allow_relation(comment, post))
+        self.assertIsNone(self.router.allow_relation(post, Post()))
+
+
+@skipUnless(
+    settings.HOT_DATABASE in settings.DATABASES,
+    'Отдельная база не настроена: задайте DJANGO_HOT_DATABASE.',
+)
+class HotDatabaseIntegrationTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.post = Post.objects.create(author=self.author, text='Статья')
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_follow_comment_and_pages(self):
+        """Подписка и комментарий пишутся в hot, счётчики и страницы верны."""
+        self.client.get(reverse('posts:profile_follow', args=['author']))
+        self.client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Комментарий в отдельной базе'},
+        )
+        self.assertTrue(Follow.objects.using(settings.HOT_DATABASE).filter(
+            user=self.reader, author=self.author).exists())
+        self.assertTrue(Comment.objects.using(settings.HOT_DATABASE).filter(
+            post=self.post).exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(pk=self.author.pk).followers_count, 1)
+        self.assertEqual(self.reader.timeline.count(), 1)
+        for url in (reverse('posts:index'),
+                    reverse('posts:profile', args=['author']),
+                    reverse('posts:follow_index')):
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'Статья')
+        self.assertContains(
+            self.client.get(
+                reverse('posts:post_detail', args=[self.post.pk])),
+            'Комментарий в отдельной базе',
+        )
+        self.client.get(reverse('posts:profile_unfollow', args=['author']))
+        self.assertEqual(
+            UserStats.objects.get(pk=self.author.pk).followers_count, 0)
+        self.assertFalse(self.reader.timeline.exists())
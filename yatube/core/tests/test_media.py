@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+from http import HTTPStatus
+
+from django.test import TestCase, override_settings
+
+
+class MediaServeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        for name, content in (('posts/ab/photo.jpg', b'0123456789'),
+                              ('avatars/me.txt', b'hello'),
+                              ('avatars/empty.txt', b''),
+                              ('.incoming/part', b'secret')):
+            path = os.path.join(self.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(content)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_hashed_names_are_immutable(self):
+        """Файлы с хешем в имени кешируются навсегда, прочие — на время."""
+        response = self.client.get('/media/posts/ab/photo.jpg')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.client.get('/media/avatars/me.txt')
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_etag_and_ranges(self):
+        """If-None-Match даёт 304, Range — часть файла или 416."""
+        etag = self.client.get('/media/posts/ab/photo.jpg')['ETag']
+        response = self.client.get(
+            '/media/posts/ab/photo.jpg', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        for header, content_range, content in (
+                ('bytes=2-4', 'bytes 2-4/10', b'234'),
+                ('bytes=7-', 'bytes 7-9/10', b'789'),
+                ('bytes=-2', 'bytes 8-9/10', b'89')):
+            with self.subTest(header=header):
+                response = self.client.get(
+                    '/media/posts/ab/photo.jpg', HTTP_RANGE=header)
+                self.assertEqual(
+                    response.status_code, HTTPStatus.PARTIAL_CONTENT)
+                self.assertEqual(response['Content-Range'], content_range)
+                self.assertEqual(
+                    b''.join(response.streaming_content), content)
+        response = self.client.get(
+            '/media/posts/ab/photo.jpg', HTTP_RANGE='bytes=20-')
+        self.assertEqual(
+            response.status_code, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        response = self.client.get(
+            '/media/posts/ab/photo.jpg',
+            HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_ranges_of_empty_file(self):
+        """Любой диапазон пустого файла даёт 416 с bytes */0."""
+        for header in ('bytes=-5', 'bytes=0-'):
+            with self.subTest(header=header):
+                response = self.client.get(
+                    '/media/avatars/empty.txt', HTTP_RANGE=header)
+                self.assertEqual(
+                    response.status_code,
+                    HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.assertEqual(response['Content-Range'], 'bytes */0')
+
+    def test_hidden_and_missing_files(self):
+        """Служебные, отсутствующие и внешние файлы не отдаются."""
+        for path in ('/media/.incoming/part', '/media/posts/missing.jpg',
+                     '/media/posts/', '/media/../settings.py'):
+            with self.subTest(path=path):
+                self.assertEqual(
+                    self.client.get(path).status_code, HTTPStatus.NOT_FOUND)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='/protected-media/')
+    def test_accel_redirect(self):
+        """С MEDIA_ACCEL_REDIRECT файл отдаёт nginx."""
+        response = self.client.get('/media/posts/ab/photo.jpg')
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected-media/posts/ab/photo.jpg')
+        self.assertEqual(response.content, b'')
+        self.assertIn('immutable', response['Cache-Control'])
@@ -0,0 +1,125 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from core import replica
+from core.cache import SITE, get_versions, versioned_cache_page
+from posts.models import Post, User
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'replica.sqlite3')
+        patcher = mock.patch('core.replica.replica_path',
+                             return_value=self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = replica.ReplicaRouter()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def request(self, write=False, method='get', decorator=None, **cookies):
+        """Вызывает «вью» через middleware, возвращает (базы, ответ)."""
+        databases = []
+
+        def view(request):
+            databases.append(self.router.db_for_read(Post))
+            if write:
+                self.router.db_for_write(Post)
+                databases.append(self.router.db_for_read(Post))
+            databases.append(self.router.db_for_read(User))
+            return HttpResponse()
+        if decorator is not None:
+            view = decorator(view)
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies)
+        response = replica.ReplicaMiddleware(view)(request)
+        return databases, response
+
+    def test_reads_go_to_replica_once_it_exists(self):
+        """Статьи читаются из реплики, когда её файл уже создан."""
+        self.assertEqual(self.request()[0], [None, None])
+        open(self.path, 'wb').close()
+        self.assertEqual(self.request()[0], ['replica', None])
+        self.assertIsNone(self.router.db_for_read(Post))
+
+    def test_writes_pin_reads_to_default(self):
+        """После записи чтения идут в основную базу, пока жива кука."""
+        open(self.path, 'wb').close()
+        databases, response = self.request(write=True)
+        self.assertEqual(databases, ['replica', None, None])
+        self.assertIn(replica.REPLICA_COOKIE, response.cookies)
+        databases, response = self.request(**{replica.REPLICA_COOKIE: '1'})
+        self.assertEqual(databases, [None, None])
+        self.assertNotIn(replica.REPLICA_COOKIE, response.cookies)
+
+    def test_unsafe_methods_read_from_default(self):
+        """POST читает из основной базы ещё до первой записи."""
+        open(self.path, 'wb').close()
+        self.assertEqual(self.request(method='post')[0], [None, None])
+        self.assertEqual(self.request(method='head')[0], ['replica', None])
+
+    def test_use_primary_pins_get(self):
+        """Вью с use_primary читает из основной базы и на GET."""
+        open(self.path, 'wb').close()
+        databases, response = self.request(decorator=replica.use_primary)
+        self.assertEqual(databases, [None, None])
+        self.assertNotIn(replica.REPLICA_COOKIE, response.cookies)
+
+    def test_pinned_requests_bypass_page_cache(self):
+        """Закреплённые запросы не читают и не пишут кеш страниц."""
+        calls = []
+
+        @versioned_cache_page()
+        def view(request):
+            calls.append(replica.pinned())
+            return HttpResponse('Страница')
+
+        def get(**cookies):
+            request = RequestFactory().get('/cached/')
+            request.user = AnonymousUser()
+            request.COOKIES.update(cookies)
+            replica.ReplicaMiddleware(view)(request)
+
+        open(self.path, 'wb').close()
+        cache.clear()
+        get(**{replica.REPLICA_COOKIE: '1'})
+        get()
+        get()
+        get(**{replica.REPLICA_COOKIE: '1'})
+        self.assertEqual(calls, [True, False, True])
+
+    @override_settings(REPLICA_DATABASE='default')
+    def test_refresh_command_resets_page_versions(self):
+        """После обновления реплики страницы в кеше пересчитываются."""
+        before = get_versions([SITE])
+        with mock.patch('core.replica.refresh') as refresh:
+            call_command('refresh_replica', stdout=StringIO())
+        refresh.assert_called_once_with()
+        self.assertNotEqual(get_versions([SITE]), before)
+
+    def test_refresh_copies_database(self):
+        """refresh копирует основную базу в файл реплики."""
+        source = os.path.join(self.directory, 'source.sqlite3')
+        with sqlite3.connect(source) as connection:
+            connection.execute('CREATE TABLE post (text TEXT)')
+            connection.execute("INSERT INTO post VALUES ('Статья')")
+        connection.close()
+        replica.refresh(source, self.path)
+        with sqlite3.connect(self.path) as connection:
+            self.assertEqual(
+                connection.execute('SELECT text FROM post').fetchall(),
+                [('Статья',)],
+            )
+        connection.close()
@@ -0,0 +1,46 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+
+from core.storage import ContentAddressedStorage, walk
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(location=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_name_is_sharded_content_hash(self):
+        """Файл сохраняется под хешем содержимого в каталогах ab/cd."""
+        digest = hashlib.sha256(b'content').hexdigest()
+        name = self.storage.save('posts/photo.JPG', ContentFile(b'content'))
+        self.assertEqual(
+            name, f'posts/{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), b'content')
+
+    def test_identical_uploads_share_one_file(self):
+        """Одинаковые загрузки занимают один файл, разные — разные."""
+        first = self.storage.save('posts/a.gif', ContentFile(b'same'))
+        second = self.storage.save('posts/b.gif', ContentFile(b'same'))
+        other = self.storage.save('posts/c.gif', ContentFile(b'other'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(list(walk(self.storage)), sorted([first, other]))
+        self.assertEqual(
+            os.listdir(os.path.join(self.directory, '.incoming')), [])
+
+    def test_reused_file_gets_fresh_mtime(self):
+        """Повторная загрузка старого файла обновляет время изменения."""
+        name = self.storage.save('posts/a.gif', ContentFile(b'same'))
+        path = self.storage.path(name)
+        os.utime(path, (0, 0))
+        self.storage.save('posts/b.gif', ContentFile(b'same'))
+        self.assertGreater(os.path.getmtime(path), 0)
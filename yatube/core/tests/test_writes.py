@@ -0,0 +1,69 @@
+from unittest import mock
+
+from django.db import OperationalError, transaction
+from django.test import TransactionTestCase, override_settings
+
+from core import writes
+
+
+@override_settings(WRITE_RETRIES=2)
+@mock.patch('core.writes.backoff', return_value=0)
+class WriteRetryTests(TransactionTestCase):
+    def flaky(self, failures, message='database is locked'):
+        calls = []
+
+        def write():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise OperationalError(message)
+            return len(calls)
+        return write, calls
+
+    def test_locked_write_is_retried(self, backoff):
+        """Запись при блокировке базы повторяется и в итоге проходит."""
+        retries_before = writes.write_metrics().get('retry', 0)
+        write, _ = self.flaky(failures=2)
+        self.assertEqual(writes.run(write), 3)
+        self.assertEqual(
+            writes.write_metrics()['retry'], retries_before + 2)
+        self.assertIn('lock_wait', writes.write_metrics())
+
+    def test_retries_are_bounded(self, backoff):
+        """Повторов не больше WRITE_RETRIES, другие ошибки не повторяются."""
+        for failures, message, expected_calls in (
+                (5, 'database is locked', 3),
+                (1, 'no such table', 1)):
+            with self.subTest(message=message):
+                write, calls = self.flaky(failures, message)
+                with self.assertRaises(OperationalError):
+                    writes.run(write)
+                self.assertEqual(len(calls), expected_calls)
+
+    def test_no_retry_inside_outer_transaction(self, backoff):
+        """Внутри чужой транзакции запись не повторяется."""
+        write, calls = self.flaky(failures=1)
+        with self.assertRaises(OperationalError), transaction.atomic():
+            writes.run(write)
+        self.assertEqual(len(calls), 1)
+
+
+class WriterLockTests(TransactionTestCase):
+    def test_locks_are_per_database(self):
+        """Записи в разные базы не ждут друг друга."""
+        self.assertIs(writes.writer_lock('default'),
+                      writes.writer_lock('default'))
+        self.assertIsNot(writes.writer_lock('default'),
+                         writes.writer_lock('hot'))
+
+    def test_side_effects_wait_for_other_database(self):
+        """Записи в основную базу ждут фиксации записи в другой базе."""
+        calls = []
+        writes.after_write('default', lambda: calls.append('default'))
+        self.assertEqual(calls, ['default'])
+        with mock.patch('core.writes.transaction.on_commit') as on_commit:
+            writes.after_write('hot', lambda: calls.append('hot'))
+        self.assertEqual(calls, ['default'])
+        callback = on_commit.call_args[0][0]
+        self.assertEqual(on_commit.call_args[1], {'using': 'hot'})
+        callback()
+        self.assertEqual(calls, ['default', 'hot'])
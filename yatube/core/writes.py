@@ -0,0 +1,105 @@
+"""Короткие записи в SQLite по одной от процесса, с повтором.
+
+SQLite пускает одного писателя на всю базу. Если потоки одного процесса
+пишут одновременно, они толкаются за блокировку файла, и кто-то получает
+«database is locked». run выстраивает записи процесса в очередь на
+threading.Lock — свой для каждой базы, так что записи в отдельную базу
+(core.hot) не ждут основную, — а ошибку блокировки от других процессов
+повторяет не больше WRITE_RETRIES раз с паузой со случайным разбросом
+(full jitter). Так под нагрузкой пользователь дольше ждёт, а не получает
+500.
+
+Повтор откатывает только транзакцию своей базы. Побочные записи
+сигналов в основную базу, когда сама запись идёт в другую, нужно
+откладывать через after_write: иначе повтор выполнил бы их дважды.
+
+write_metrics отдаёт счётчики процесса: записи, повторы, отказы и время
+ожидания очереди в секундах.
+"""
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, transaction
+
+
+_writer_locks = defaultdict(threading.Lock)
+_writer_locks_lock = threading.Lock()
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+
+
+def record(event, amount=1):
+    with _metrics_lock:
+        _metrics[event] += amount
+
+
+def record_wait(seconds):
+    with _metrics_lock:
+        _metrics['lock_wait'] += seconds
+        _metrics['lock_wait_max'] = max(_metrics['lock_wait_max'], seconds)
+
+
+def write_metrics():
+    """Счётчики процесса: write, retry, failure, lock_wait, lock_wait_max."""
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def writer_lock(using):
+    with _writer_locks_lock:
+        return _writer_locks[using]
+
+
+def after_write(using, func):
+    """Выполняет запись func в основную базу вместе с записью в using.
+
+    Если using — основная база, func выполняется сразу, в её транзакции,
+    и откатывается вместе с ней. Иначе func откладывается до фиксации
+    using и выполняется своей записью через run: откат или повтор записи
+    в using её не выполнят.
+    """
+    if using == DEFAULT_DB_ALIAS:
+        func()
+    else:
+        transaction.on_commit(lambda: run(func), using=using)
+
+
+def is_locked(error):
+    return 'database is locked' in str(error)
+
+
+def backoff(attempt):
+    cap = min(
+        settings.WRITE_BACKOFF_MAX, settings.WRITE_BACKOFF * 2 ** attempt
+    )
+    return random.uniform(0, cap)
+
+
+def run(func, *args, using=DEFAULT_DB_ALIAS, **kwargs):
+    """Выполняет func в своей транзакции, повторяя при блокировке базы.
+
+    Внутри чужой транзакции повторять бессмысленно: откатится только
+    точка сохранения, а блокировку держит внешняя транзакция.
+    """
+    retries = settings.WRITE_RETRIES
+    if transaction.get_connection(using).in_atomic_block:
+        retries = 0
+    for attempt in range(retries + 1):
+        started = time.monotonic()
+        with writer_lock(using):
+            record_wait(time.monotonic() - started)
+            try:
+                with transaction.atomic(using=using):
+                    result = func(*args, **kwargs)
+            except OperationalError as error:
+                if not is_locked(error) or attempt == retries:
+                    record('failure')
+                    raise
+            else:
+                record('write')
+                return result
+        record('retry')
+        time.sleep(backoff(attempt))
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from . import search
 from .models import Post, Group, Comment, Follow
 
 
@@ -16,6 +17,15 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search.available() or not search.match_expression(search_term):
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return queryset.filter(
+            pk__in=search.matching_post_ids(search_term)
+        ), False
+
 
 admin.site.register(Post, PostAdmin)
 
@@ -54,6 +64,8 @@ class CommentAdmin(admin.ModelAdmin):
     search_fields = ('text', 'author', 'post', 'created')
     search_fields = ('text', 'author', 'post')
     list_filter = ('created',)
+    # Комментарии могут быть в другой базе (core.hot), JOIN с ней нельзя.
+    list_select_related = ()
 
 
 admin.site.register(Comment, CommentAdmin)
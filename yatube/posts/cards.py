@@ -0,0 +1,33 @@
+"""Версии закешированных карточек статей.
+
+Карточка в ленте кешируется тегом {% cache %} по pk статьи и card_version.
+Версия складывается из версий статьи, её группы и автора, которые сигналы
+увеличивают при правке статьи, изменении группы и смене имени автора.
+"""
+from core.cache import get_versions
+
+
+def card_namespace(kind, pk):
+    return f'card:{kind}:{pk}'
+
+
+def card_namespaces(post):
+    namespaces = [
+        card_namespace('post', post.pk),
+        card_namespace('author', post.author_id),
+    ]
+    if post.group_id is not None:
+        namespaces.append(card_namespace('group', post.group_id))
+    return namespaces
+
+
+def attach_card_versions(posts):
+    """Проставляет статьям card_version одним обращением к кешу."""
+    posts = list(posts)
+    namespaces = {post.pk: card_namespaces(post) for post in posts}
+    unique = sorted({name for names in namespaces.values() for name in names})
+    versions = dict(zip(unique, get_versions(unique)))
+    for post in posts:
+        post.card_version = '.'.join(
+            str(versions[name]) for name in namespaces[post.pk]
+        )
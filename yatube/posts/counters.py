@@ -0,0 +1,116 @@
+"""Денормализованные счётчики статей, комментариев и подписок.
+
+Счётчики меняются F-выражениями из сигналов, поэтому попадают в ту же
+транзакцию, что и изменение статьи, комментария или подписки. Разошедшиеся
+значения исправляет команда reconcile_counters.
+"""
+from django.db import router
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import (
+    Comment, Follow, Group, Post, StoredImage, User, UserStats)
+
+
+def bump(model, pk, **deltas):
+    if pk is None:
+        return
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)
+           for field, delta in deltas.items()}
+    )
+
+
+def count_of(model, field):
+    """Подзапрос с числом строк model, ссылающихся на внешний объект."""
+    rows = (
+        model.objects.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(total=Count('pk')).values('total')
+    )
+    return Coalesce(Subquery(rows), Value(0))
+
+
+def counts_by(model, field, keys):
+    """Число строк model для каждого из keys одним запросом."""
+    return dict(
+        model.objects.filter(**{f'{field}__in': keys}).order_by()
+        .values_list(field).annotate(total=Count('pk'))
+    )
+
+
+# Для каждой модели: поле счётчика и (модель, поле), чьи строки он считает.
+COUNTERS = {
+    Group: {
+        'posts_count': (Post, 'group'),
+    },
+    Post: {
+        'comments_count': (Comment, 'post'),
+    },
+    UserStats: {
+        'posts_count': (Post, 'author'),
+        'followers_count': (Follow, 'author'),
+        'following_count': (Follow, 'user'),
+    },
+    StoredImage: {
+        'references': (Post, 'image'),
+    },
+}
+
+
+def create_missing_stats():
+    """Создаёт счётчики для пользователей, у которых их ещё нет."""
+    users = User.objects.filter(stats__isnull=True).values_list(
+        'pk', flat=True)
+    UserStats.objects.bulk_create(
+        (UserStats(user_id=pk) for pk in users.iterator()),
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+def reconcile(model, chunk_size=500):
+    """Пересчитывает счётчики model порциями, возвращает число исправлений.
+
+    Для UserStats подзапросы ссылаются на пользователя, поэтому внешним
+    ключом служит user_id, совпадающий с pk.
+    """
+    counters = COUNTERS[model]
+    database = router.db_for_read(model)
+    # Строки из другой базы (core.hot) считаются отдельным запросом на
+    # порцию, остальные — подзапросом.
+    remote = {
+        field: source for field, source in counters.items()
+        if router.db_for_read(source[0]) != database
+    }
+    fixed = 0
+    last_pk = None
+    while True:
+        chunk = model.objects.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk.annotate(**{
+            f'actual_{field}': count_of(*source)
+            for field, source in counters.items() if field not in remote
+        })[:chunk_size])
+        if not chunk:
+            return fixed
+        remote_counts = {
+            field: counts_by(*source, [obj.pk for obj in chunk])
+            for field, source in remote.items()
+        }
+        drifted = []
+        for obj in chunk:
+            changed = False
+            for field in counters:
+                if field in remote:
+                    actual = remote_counts[field].get(obj.pk, 0)
+                else:
+                    actual = getattr(obj, f'actual_{field}')
+                if getattr(obj, field) != actual:
+                    setattr(obj, field, actual)
+                    changed = True
+            if changed:
+                drifted.append(obj)
+        model.objects.bulk_update(drifted, list(counters))
+        fixed += len(drifted)
+        last_pk = chunk[-1].pk
@@ -0,0 +1,44 @@
+from django.template.loader import render_to_string
+
+from core.holes import register
+
+from .forms import CommentForm
+from .models import Follow, User
+
+
+@register('switcher')
+def switcher(request):
+    return render_to_string(
+        'posts/includes/switcher.html', request=request
+    )
+
+
+@register('follow_button')
+def follow_button(request, username):
+    following = (
+        request.user.is_authenticated
+        and Follow.objects.filter(
+            user=request.user,
+            # Подписки могут быть в другой базе, поэтому без JOIN.
+            author_id=User.objects.filter(username=username)
+            .values_list('pk', flat=True).first(),
+        ).exists()
+    )
+    return render_to_string(
+        'posts/includes/follow_button.html',
+        {'username': username, 'following': following},
+        request=request,
+    )
+
+
+@register('post_actions')
+def post_actions(request, post_id, author_id):
+    return render_to_string(
+        'posts/includes/post_actions.html',
+        {
+            'post_id': post_id,
+            'is_author': str(request.user.pk) == str(author_id),
+            'form': CommentForm(),
+        },
+        request=request,
+    )
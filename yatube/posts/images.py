@@ -0,0 +1,189 @@
+"""Метаданные картинок статей.
+
+Размеры, формат, размер файла и SHA-256 считываются один раз при загрузке
+и хранятся в полях Post, поэтому при выводе файл открывать не нужно.
+Картинки, загруженные раньше, дополняет команда backfill_image_metadata.
+
+Загрузки нормализуются до сохранения (normalize): слишком большие файлы
+и картинки отклоняются, не распаковывая пиксели, крупные уменьшаются,
+EXIF удаляется, JPEG пишется прогрессивным, PNG — оптимизированным.
+Результат пишется во временный файл, а не в память.
+
+Файлы картинок общие для статей с одинаковыми загрузками, поэтому сигналы
+считают ссылки на них в StoredImage: acquire при появлении картинки у
+статьи, release при замене или удалении. Файл без ссылок удаляется вместе
+с миниатюрами после фиксации транзакции.
+
+Ссылка на новую загрузку берётся до записи файла (acquire_upload): иначе
+параллельная загрузка того же содержимого могла найти файл, который
+delete_if_unused удалит раньше, чем она сохранит статью. Проверка ссылок
+и удаление файла идут в одной транзакции, так что в SQLite они не
+вклиниваются между acquire_upload и сохранением.
+"""
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
+from PIL import Image, ImageOps
+from sorl.thumbnail import delete
+from sorl.thumbnail.images import ImageFile
+
+from .counters import bump
+from .models import Post, StoredImage
+
+logger = logging.getLogger(__name__)
+
+
+FIELDS = (
+    'image_width', 'image_height', 'image_format', 'image_size',
+    'image_hash',
+)
+
+
+def read_metadata(file):
+    """Метаданные файла картинки; файл читается порциями."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in file.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    with Image.open(file) as image:
+        width, height = image.size
+        image_format = image.format or ''
+    file.seek(0)
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_format': image_format,
+        'image_size': size,
+        'image_hash': digest.hexdigest(),
+    }
+
+
+# Форматы, которые всегда перекодируются, и их расширения.
+NORMALIZED_FORMATS = {'JPEG': '.jpg', 'PNG': '.png'}
+
+
+def normalize(upload):
+    """Проверяет загруженную картинку и приводит её к нормальному виду.
+
+    Возвращает upload, если менять нечего, иначе новый временный файл.
+    Анимированные картинки и небольшие GIF в пределах ограничений не
+    трогает.
+    """
+    if upload.size > settings.POST_IMAGE_MAX_BYTES:
+        raise ValidationError(
+            'Файл больше %(limit)s МБ.',
+            code='file_too_large',
+            params={'limit': settings.POST_IMAGE_MAX_BYTES // 2 ** 20},
+        )
+    upload.seek(0)
+    try:
+        image = Image.open(upload)
+    except Image.DecompressionBombError:
+        image = None
+    if image is None or (
+            image.width * image.height > settings.POST_IMAGE_MAX_PIXELS):
+        raise ValidationError(
+            'Картинка больше %(limit)s мегапикселей.',
+            code='too_many_pixels',
+            params={'limit': settings.POST_IMAGE_MAX_PIXELS // 10 ** 6},
+        )
+    with image:
+        max_side = settings.POST_IMAGE_MAX_SIDE
+        oversized = max(image.size) > max_side
+        # В GIF нет EXIF, так что небольшой GIF можно не перекодировать;
+        # остальные форматы перекодируются всегда, чтобы не пропустить
+        # метаданные.
+        if getattr(image, 'is_animated', False) or (
+                image.format == 'GIF' and not oversized):
+            upload.seek(0)
+            return upload
+        image_format = image.format
+        if image_format not in NORMALIZED_FORMATS:
+            image_format = 'PNG' if 'A' in image.getbands() else 'JPEG'
+        icc_profile = image.info.get('icc_profile')
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        name = (
+            os.path.splitext(upload.name)[0]
+            + NORMALIZED_FORMATS[image_format]
+        )
+        result = TemporaryUploadedFile(
+            name, f'image/{image_format.lower()}', 0, None
+        )
+        options = {'optimize': True}
+        if image_format == 'JPEG':
+            options.update(
+                progressive=True, quality=settings.POST_IMAGE_JPEG_QUALITY
+            )
+        if icc_profile:
+            options['icc_profile'] = icc_profile
+        # EXIF и прочие метаданные не передаются и в файл не попадают.
+        image.save(result.file, image_format, **options)
+    result.size = result.file.tell()
+    result.seek(0)
+    return result
+
+
+def fill_metadata(post):
+    """Заполняет метаданные картинки статьи или очищает их."""
+    if post.image:
+        metadata = read_metadata(post.image)
+    else:
+        metadata = dict.fromkeys(FIELDS)
+        metadata.update(image_format='', image_hash='')
+    for field, value in metadata.items():
+        setattr(post, field, value)
+
+
+def storage():
+    return Post._meta.get_field('image').storage
+
+
+def acquire(name):
+    if name:
+        StoredImage.objects.get_or_create(name=name)
+        bump(StoredImage, name, references=1)
+
+
+def acquire_upload(post):
+    """Берёт ссылку на файл несохранённой загрузки и возвращает его имя.
+
+    Имя считается по image_hash, поэтому fill_metadata должна быть вызвана
+    раньше.
+    """
+    name = storage().content_name(
+        Post._meta.get_field('image').generate_filename(
+            post, post.image.name),
+        post.image_hash,
+    )
+    acquire(name)
+    return name
+
+
+def release(name):
+    if name:
+        bump(StoredImage, name, references=-1)
+        transaction.on_commit(lambda: delete_if_unused(name))
+
+
+def delete_if_unused(name):
+    """Удаляет файл и его миниатюры, если на него больше не ссылаются."""
+    with transaction.atomic():
+        deleted, _ = StoredImage.objects.filter(
+            name=name, references=0
+        ).delete()
+        if not deleted:
+            return
+        try:
+            delete(ImageFile(name, storage()))
+        except (OSError, SuspiciousFileOperation):
+            logger.exception('Не удалось удалить картинку %s', name)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from posts import images
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Дополняет метаданными картинки, загруженные раньше.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=100,
+            help='Сколько статей обрабатывать за один запрос.',
+        )
+
+    def handle(self, *args, **options):
+        pending = Post.objects.exclude(image='').filter(image_hash='')
+        filled = failed = 0
+        last_pk = 0
+        while True:
+            chunk = list(
+                pending.filter(pk__gt=last_pk).order_by('pk')
+                .only('pk', 'image')[:options['chunk_size']]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            updated = []
+            for post in chunk:
+                try:
+                    with post.image.open('rb'):
+                        images.fill_metadata(post)
+                except (OSError, ValueError) as error:
+                    failed += 1
+                    self.stderr.write(f'{post.image.name}: {error}')
+                    continue
+                updated.append(post)
+            Post.objects.bulk_update(updated, images.FIELDS)
+            filled += len(updated)
+        self.stdout.write(
+            f'Дополнено картинок: {filled}, с ошибками: {failed}'
+        )
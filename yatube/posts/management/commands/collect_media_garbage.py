@@ -0,0 +1,134 @@
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from sorl.thumbnail import default, delete
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from core.storage import INCOMING_DIR, walk
+from posts.models import Post, StoredImage
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки статей и миниатюры, на которые ничего не '
+        'ссылается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько файлов проверять и удалять за раз.',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.1,
+            help='Пауза в секундах между порциями.',
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Не трогать файлы моложе стольких секунд: они могут '
+                 'принадлежать ещё не сохранённой статье.',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+        field = Post._meta.get_field('image')
+        upload_to = field.upload_to.rstrip('/')
+        prefix = sorl_settings.THUMBNAIL_PREFIX.rstrip('/')
+        reports = [
+            ('Картинки', self.collect(
+                field.storage, upload_to, self.unused_originals,
+                self.delete_originals,
+            )),
+            ('Миниатюры', self.collect(
+                default.storage, prefix, self.unknown_thumbnails,
+                self.delete_files(default.storage),
+            )),
+            ('Недописанные загрузки', self.collect(
+                field.storage, INCOMING_DIR, lambda names: names,
+                self.delete_files(field.storage), hidden=True,
+            )),
+        ]
+        verb = 'будет удалено' if options['dry_run'] else 'удалено'
+        for label, (count, size) in reports:
+            self.stdout.write(
+                f'{label}: {verb} {count} файлов, {size} байт'
+            )
+
+    def collect(self, storage, path, find_garbage, delete_garbage,
+                hidden=False):
+        """Проходит по файлам path порциями, возвращает (число, байты)."""
+        if not storage.exists(path):
+            return 0, 0
+        if hidden:
+            names = (f'{path}/{name}' for name in storage.listdir(path)[1])
+        else:
+            names = walk(storage, path)
+        count = size = 0
+        for batch in batches(names, self.options['batch_size']):
+            garbage = [
+                name for name in find_garbage(batch)
+                if storage.get_modified_time(name) < self.cutoff
+            ]
+            if not garbage:
+                continue
+            for name in garbage:
+                size += storage.size(name)
+                if self.options['verbosity'] > 1:
+                    self.stdout.write(name)
+            count += len(garbage)
+            if not self.options['dry_run']:
+                delete_garbage(garbage)
+                time.sleep(self.options['sleep'])
+        return count, size
+
+    def unused_originals(self, names):
+        used = set(
+            Post.objects.filter(image__in=names)
+            .values_list('image', flat=True)
+        )
+        return [name for name in names if name not in used]
+
+    def delete_originals(self, names):
+        storage = Post._meta.get_field('image').storage
+        StoredImage.objects.filter(name__in=names).delete()
+        for name in names:
+            # Вместе с файлом удаляются его миниатюры из хранилища sorl.
+            delete(ImageFile(name, storage))
+
+    def unknown_thumbnails(self, names):
+        """Миниатюры, о которых не знает хранилище ключей sorl."""
+        keys = {
+            add_prefix(ImageFile(name, default.storage).key): name
+            for name in names
+        }
+        known = set(
+            KVStore.objects.filter(key__in=keys).values_list('key', flat=True)
+        )
+        return [name for key, name in keys.items() if key not in known]
+
+    @staticmethod
+    def delete_files(storage):
+        def delete_garbage(names):
+            for name in names:
+                storage.delete(name)
+        return delete_garbage
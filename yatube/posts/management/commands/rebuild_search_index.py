@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Строит заново полнотекстовый индекс статей и комментариев.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Сколько строк индексировать за один запрос.',
+        )
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError('Полнотекстовый поиск работает только в SQLite')
+        total = search.rebuild(options['chunk_size'])
+        self.stdout.write(f'Проиндексировано записей: {total}')
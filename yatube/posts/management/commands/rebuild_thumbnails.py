@@ -0,0 +1,57 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.storage import walk
+from posts import thumbnails
+from posts.models import Post
+
+
+def rebuild(name, force):
+    try:
+        thumbnails.generate(name, force=force)
+    except Exception as error:
+        return name, str(error)
+    return name, None
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры всех картинок статей на всех ядрах.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Сколько процессов создают миниатюры.',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать уже существующие миниатюры.',
+        )
+
+    def handle(self, *args, **options):
+        field = Post._meta.get_field('image')
+        upload_to = field.upload_to.rstrip('/')
+        names = []
+        if field.storage.exists(upload_to):
+            names = list(walk(field.storage, upload_to))
+        forces = [options['force']] * len(names)
+        if options['workers'] > 1:
+            # Дочерние процессы не должны делить соединения родителя.
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=options['workers'])
+            results = pool.map(rebuild, names, forces, chunksize=16)
+        else:
+            pool = None
+            results = map(rebuild, names, forces)
+        failed = 0
+        for name, error in results:
+            if error is not None:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+        if pool is not None:
+            pool.shutdown()
+        self.stdout.write(
+            f'Обработано картинок: {len(names)}, с ошибками: {failed}'
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+from posts.models import Group, Post, StoredImage, UserStats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики порциями.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Сколько строк пересчитывать за один запрос.',
+        )
+
+    def handle(self, *args, **options):
+        counters.create_missing_stats()
+        for model in (UserStats, Group, Post, StoredImage):
+            fixed = counters.reconcile(model, options['chunk_size'])
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: исправлено {fixed}'
+            )
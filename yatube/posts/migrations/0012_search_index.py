@@ -0,0 +1,45 @@
+# Generated by Django 2.2.16 on 2026-10-18 08:10
+
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS posts_search USING fts5('
+            'text, post_id UNINDEXED, '
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        cursor.executemany(
+            'INSERT INTO posts_search (rowid, text, post_id) '
+            'VALUES (%s, %s, %s)',
+            [
+                (2 * pk, text, pk)
+                for pk, text in Post.objects.values_list('pk', 'text')
+            ] + [
+                (2 * pk + 1, text, post_id)
+                for pk, text, post_id in Comment.objects.values_list(
+                    'pk', 'text', 'post_id')
+            ],
+        )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS posts_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_auto_20261018_0759'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
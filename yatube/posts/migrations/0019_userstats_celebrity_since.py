@@ -0,0 +1,36 @@
+# Generated by Django 2.2.16 on 2026-10-18 11:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Now
+
+
+def mark_celebrities(apps, schema_editor):
+    # Статьи нынешних популярных авторов не раскладывались с самой первой.
+    Post = apps.get_model('posts', 'Post')
+    UserStats = apps.get_model('posts', 'UserStats')
+    threshold = getattr(settings, 'FOLLOW_FANOUT_THRESHOLD', 1000)
+    first_post = (
+        Post.objects.filter(author_id=models.OuterRef('pk')).order_by()
+        .values('author_id').annotate(first=models.Min('pub_date'))
+        .values('first')
+    )
+    UserStats.objects.filter(followers_count__gt=threshold).update(
+        celebrity_since=Coalesce(models.Subquery(first_post), Now())
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_timeline_pub_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='celebrity_since',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Популярен с'),
+        ),
+        migrations.RunPython(mark_celebrities, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,12 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth import get_user_model
 
 from pytils.translit import slugify
 
+from core.storage import ContentAddressedStorage
+
 
 User = get_user_model()
 
@@ -26,6 +30,11 @@ class Group(models.Model):
         'Текст',
         help_text='Краткое описание группы'
     )
+    posts_count = models.PositiveIntegerField(
+        'Число статей',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Группа'
@@ -50,15 +59,19 @@ class Post(models.Model):
         auto_now_add=True,
         db_index=True,
     )
+    # Отдельные индексы author и group не нужны: с них начинаются
+    # составные индексы лент в Meta.indexes.
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='posts',
         verbose_name='Автор',
     )
     group = models.ForeignKey(
         Group,
         on_delete=models.SET_NULL,
+        db_index=False,
         blank=True,
         null=True,
         related_name='posts',
@@ -68,29 +81,70 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
         help_text='Загрузите изображение',
     )
+    # Заполняются при загрузке картинки (см. posts.images), чтобы
+    # выводить её без чтения файла.
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки', null=True, editable=False,
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки', null=True, editable=False,
+    )
+    image_format = models.CharField(
+        'Формат картинки', max_length=10, blank=True, editable=False,
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер картинки в байтах', null=True, editable=False,
+    )
+    image_hash = models.CharField(
+        'SHA-256 картинки', max_length=64, blank=True, editable=False,
+    )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Статя'
         verbose_name_plural = 'Статьи'
         ordering = ['-pub_date']
+        # Ленты автора и группы идут в порядке (-pub_date, -pk), см.
+        # CursorPaginator.
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_feed_idx',
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_feed_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
 
 class Comment(models.Model):
+    # Комментарии и подписки могут жить в отдельной базе (core.hot),
+    # поэтому ссылки из них без ограничений в базе, а каскадное удаление
+    # делают сигналы posts.signals.
     post = models.ForeignKey(
         Post,
-        on_delete=models.CASCADE,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
         related_name='comments',
         verbose_name='Автор',
     )
     author = models.ForeignKey(
         User,
-        on_delete=models.CASCADE,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
         related_name='comments',
         verbose_name='Автор',
     )
@@ -107,6 +161,11 @@ class Comment(models.Model):
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
         ordering = ['-created']
+        indexes = [
+            models.Index(
+                fields=['post', '-created'], name='comment_post_created_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -115,12 +174,15 @@ class Comment(models.Model):
 class Follow(models.Model):
     user = models.ForeignKey(
         User,
-        on_delete=models.CASCADE,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
         related_name='follower',
     )
     author = models.ForeignKey(
         User,
-        on_delete=models.CASCADE,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
         related_name='following',
     )
 
@@ -133,6 +195,130 @@ class Follow(models.Model):
                 fields=['user', 'author'], name='unique_follow'
             )
         ]
+        # Подписчики автора (раскладка статей по лентам) без обращения к
+        # таблице: unique_follow начинается с user.
+        indexes = [
+            models.Index(
+                fields=['author', 'user'], name='follow_author_user_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user} подписан на {self.author}'
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь',
+    )
+    posts_count = models.PositiveIntegerField('Число статей', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0
+    )
+    following_count = models.PositiveIntegerField('Число подписок', default=0)
+    # Когда подписчиков стало больше FOLLOW_FANOUT_THRESHOLD: статьи с
+    # этого момента не раскладываются по лентам (posts.timeline).
+    celebrity_since = models.DateTimeField(
+        'Популярен с', null=True, blank=True
+    )
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return f'Счётчики {self.user}'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Статья',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    # Копия даты статьи: лента листается по индексу этой таблицы, без
+    # просмотра статей.
+    pub_date = models.DateTimeField('Дата статьи')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'author'], name='timeline_user_author_idx'
+            ),
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_feed_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.post} в ленте {self.user}'
+
+
+class StoredImage(models.Model):
+    """Файл картинки и число статей, которые на него ссылаются.
+
+    Одинаковые загрузки хранятся одним файлом, и он удаляется, только
+    когда ссылок не остаётся (см. posts.images).
+    """
+    name = models.CharField('Файл', max_length=100, primary_key=True)
+    references = models.PositiveIntegerField('Число ссылок', default=0)
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return self.name
+
+
+class Upload(models.Model):
+    """Картинка, загружаемая по частям (см. posts.uploads)."""
+    id = models.UUIDField(
+        primary_key=True, default=uuid.uuid4, editable=False,
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='uploads',
+        verbose_name='Пользователь',
+    )
+    filename = models.CharField('Имя файла', max_length=255)
+    size = models.PositiveIntegerField('Размер в байтах')
+    offset = models.PositiveIntegerField('Получено байт', default=0)
+    created = models.DateTimeField('Дата начала', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Загрузка'
+        verbose_name_plural = 'Загрузки'
+
+    def __str__(self):
+        return f'{self.filename}: {self.offset} из {self.size}'
+
+    @property
+    def complete(self):
+        return self.offset == self.size
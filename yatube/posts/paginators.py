@@ -0,0 +1,158 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.timezone import is_naive
+
+
+ELLIPSIS = '…'
+# Границы целого в SQLite.
+PK_MIN, PK_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def feed_count_key(kind, pk=''):
+    """Ключ кеша с числом статей ленты: all, group или author."""
+    return f'feed_count:{kind}:{pk}'
+
+
+def adjust_feed_counts(keys, delta):
+    """Поправляет закешированные счётчики; отсутствующие пропускает."""
+    for key in keys:
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            pass
+
+
+class ElidedPaginator(Paginator):
+    """Paginator с сокращённым списком номеров страниц."""
+
+    def get_elided_page_range(self, number=1, on_each_side=2, on_ends=1):
+        """Номера страниц вокруг текущей и по краям, с многоточиями."""
+        number = self.validate_number(number)
+        if self.num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > (1 + on_each_side + on_ends) + 1:
+            yield from range(1, on_ends + 1)
+            yield ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < (self.num_pages - on_each_side - on_ends) - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield ELLIPSIS
+            yield from range(self.num_pages - on_ends + 1, self.num_pages + 1)
+        else:
+            yield from range(number + 1, self.num_pages + 1)
+
+
+class CursorPaginator(ElidedPaginator):
+    """Постраничный вывод по ключу (cursor_field, pk) без OFFSET и COUNT.
+
+    Курсорные страницы (get_cursor_page) выбирают per_page + 1 строк после
+    или до переданного ключа, поэтому стоимость не зависит от глубины
+    страницы. Обычный get_page(number) оставлен для старых ссылок ?page=N.
+
+    Число объектов можно передать готовым (count), например из
+    денормализованного счётчика. Если передан count_key, оно берётся из
+    кеша. Сигналы поддерживают его при создании и удалении статей, а раз в
+    FEED_COUNT_TIMEOUT секунд оно пересчитывается, так что расхождение
+    ограничено этим окном.
+    """
+    cursor_field = 'pub_date'
+
+    def __init__(self, object_list, per_page, count_key=None, count=None,
+                 **kwargs):
+        object_list = object_list.order_by(
+            f'-{self.cursor_field}', '-pk'
+        )
+        self.count_key = count_key
+        self.known_count = count
+        super().__init__(object_list, per_page, **kwargs)
+
+    @cached_property
+    def count(self):
+        if self.known_count is not None:
+            return self.known_count
+        if self.count_key is None:
+            return super().count
+        count = cache.get(self.count_key)
+        if count is None:
+            count = super().count
+            cache.set(self.count_key, count, settings.FEED_COUNT_TIMEOUT)
+        return count
+
+    def encode_cursor(self, obj):
+        value = getattr(obj, self.cursor_field).isoformat()
+        raw = f'{value}|{obj.pk}'.encode()
+        return urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        """Возвращает (значение, pk) или None для испорченного курсора."""
+        if not token:
+            return None
+        try:
+            raw = urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            value, pk = raw.decode().split('|')
+            value, pk = parse_datetime(value), int(pk)
+        except (Base64Error, UnicodeDecodeError, ValueError):
+            return None
+        # Наивное время SQLite сравнило бы как строку без пояса, а pk вне
+        # int64 не влезает в параметр запроса.
+        if value is None or is_naive(value) or not PK_MIN <= pk <= PK_MAX:
+            return None
+        return value, pk
+
+    def seek(self, queryset, after=None, before=None, pk_field='pk'):
+        """queryset после ключа after или до ключа before, от ключа.
+
+        Условие записано как field <= value AND (field < value OR pk < pk),
+        чтобы SQLite искал по индексу диапазон, а не шёл с начала ленты.
+        """
+        field = self.cursor_field
+        if before is not None:
+            value, pk = before
+            return queryset.filter(
+                Q(**{f'{field}__gte': value}),
+                Q(**{f'{field}__gt': value}) | Q(**{f'{pk_field}__gt': pk}),
+            ).order_by(field, pk_field)
+        queryset = queryset.order_by(f'-{field}', f'-{pk_field}')
+        if after is not None:
+            value, pk = after
+            queryset = queryset.filter(
+                Q(**{f'{field}__lte': value}),
+                Q(**{f'{field}__lt': value}) | Q(**{f'{pk_field}__lt': pk}),
+            )
+        return queryset
+
+    def fetch(self, after, before, limit):
+        """До limit объектов страницы в порядке от ключа курсора."""
+        return list(self.seek(self.object_list, after, before)[:limit])
+
+    def get_cursor_page(self, after=None, before=None):
+        """Страница после курсора after, до курсора before или первая."""
+        after, before = self.decode_cursor(after), self.decode_cursor(before)
+        items = self.fetch(after, before, self.per_page + 1)
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if before is not None:
+            items.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, after is not None
+        number = 1 if after is None and before is None else None
+        page = Page(items, number, self)
+        page.is_cursor = True
+        page.next_cursor = (
+            self.encode_cursor(items[-1]) if items and has_next else None
+        )
+        page.previous_cursor = (
+            self.encode_cursor(items[0]) if items and has_previous else None
+        )
+        return page
@@ -0,0 +1,191 @@
+"""Полнотекстовый поиск по статьям и комментариям на SQLite FTS5.
+
+Индекс posts_search хранит текст статьи в строке с rowid = 2 * pk статьи
+и текст комментария в строке с rowid = 2 * pk + 1, поэтому обновление и
+удаление не требуют поиска по индексу. Сигналы поддерживают его при
+каждом изменении, команда rebuild_search_index строит его заново.
+На других СУБД поиск деградирует до icontains.
+"""
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Comment, Post
+
+
+# Таблица создаётся миграцией 0012_search_index.
+TABLE = 'posts_search'
+WORD_RE = re.compile(r'\w+')
+# Строк на один запрос: три параметра на строку не выходят за лимит
+# SQLite в 999 параметров. Один execute вместо executemany: его понимает
+# и панель SQL в debug_toolbar.
+BATCH_SIZE = 300
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def post_rowid(pk):
+    return 2 * pk
+
+
+def comment_rowid(pk):
+    return 2 * pk + 1
+
+
+def match_expression(query):
+    """Запрос пользователя как безопасное выражение MATCH.
+
+    Каждое слово ищется по префиксу, все слова должны встретиться.
+    """
+    words = WORD_RE.findall(query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def batches(items):
+    for start in range(0, len(items), BATCH_SIZE):
+        yield items[start:start + BATCH_SIZE]
+
+
+def placeholders(count, width=1):
+    row = '%s' if width == 1 else '(' + ', '.join(['%s'] * width) + ')'
+    return ', '.join([row] * count)
+
+
+def write_rows(rows):
+    """Записывает строки (rowid, text, post_id) в индекс."""
+    rows = list(rows)
+    if not rows or not available():
+        return
+    with connection.cursor() as cursor:
+        for batch in batches(rows):
+            cursor.execute(
+                f'DELETE FROM {TABLE} WHERE rowid IN '
+                f'({placeholders(len(batch))})',
+                [rowid for rowid, _, _ in batch],
+            )
+            cursor.execute(
+                f'INSERT INTO {TABLE} (rowid, text, post_id) VALUES '
+                + placeholders(len(batch), width=3),
+                [value for row in batch for value in row],
+            )
+
+
+def delete_rows(rowids):
+    rowids = list(rowids)
+    if not rowids or not available():
+        return
+    with connection.cursor() as cursor:
+        for batch in batches(rowids):
+            cursor.execute(
+                f'DELETE FROM {TABLE} WHERE rowid IN '
+                f'({placeholders(len(batch))})',
+                batch,
+            )
+
+
+def index_post(post):
+    write_rows([(post_rowid(post.pk), post.text, post.pk)])
+
+
+def index_comment(comment):
+    write_rows([(comment_rowid(comment.pk), comment.text, comment.post_id)])
+
+
+def unindex_post(pk):
+    delete_rows([post_rowid(pk)])
+
+
+def unindex_comment(pk):
+    delete_rows([comment_rowid(pk)])
+
+
+def clear():
+    if available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLE}')
+
+
+def rebuild(chunk_size):
+    """Строит индекс заново, читая статьи и комментарии порциями по pk."""
+    clear()
+    total = 0
+    sources = (
+        (Post, ('pk', 'text', 'pk'), post_rowid),
+        (Comment, ('pk', 'text', 'post_id'), comment_rowid),
+    )
+    for model, fields, rowid in sources:
+        last_pk = 0
+        while True:
+            rows = list(
+                model.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list(*fields)[:chunk_size]
+            )
+            if not rows:
+                break
+            write_rows(
+                (rowid(pk), text, post_id) for pk, text, post_id in rows
+            )
+            total += len(rows)
+            last_pk = rows[-1][0]
+    return total
+
+
+def matching_post_ids(query):
+    """Подзапрос с pk статей, подходящих под запрос, для filter(pk__in=)."""
+    return RawSQL(
+        f'SELECT post_id FROM {TABLE} WHERE {TABLE} MATCH %s',
+        (match_expression(query),),
+    )
+
+
+class SearchResults:
+    """Статьи, найденные по запросу, в порядке релевантности.
+
+    Поддерживает count() и срезы, поэтому подходит для Paginator: на
+    страницу выбираются только её pk, а статьи загружаются одним запросом.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.expression = match_expression(query)
+
+    def count(self):
+        if not self.expression:
+            return 0
+        if not available():
+            return Post.objects.filter(text__icontains=self.query).count()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(DISTINCT post_id) FROM {TABLE} '
+                f'WHERE {TABLE} MATCH %s',
+                (self.expression,),
+            )
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        if not self.expression:
+            return []
+        posts = Post.objects.select_related('author', 'group')
+        if not available():
+            return list(posts.filter(text__icontains=self.query)[start:stop])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                # rank в FTS5 по умолчанию равен bm25(), но, в отличие
+                # от функции, доступен в агрегатах.
+                f'SELECT post_id, MIN(rank) AS best FROM {TABLE} '
+                f'WHERE {TABLE} MATCH %s GROUP BY post_id '
+                'ORDER BY best, post_id DESC LIMIT %s OFFSET %s',
+                (self.expression, stop - start, start),
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        found = posts.in_bulk(ids)
+        return [found[pk] for pk in ids if pk in found]
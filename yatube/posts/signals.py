@@ -0,0 +1,198 @@
+from django.db.models import Q
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+
+from core import writes
+from core.cache import SITE, bump_versions
+
+from . import images, search, timeline
+from .counters import bump
+from .cards import card_namespace
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .paginators import adjust_feed_counts, feed_count_key
+
+
+# Поля пользователя, которые выводятся на страницах со статьями.
+USER_DISPLAY_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+def page_namespaces(post, *group_ids):
+    """Пространства имён закешированных страниц, где видна статья."""
+    try:
+        namespaces = ['index', f'profile:{post.author.username}']
+    except User.DoesNotExist:
+        # Автор удаляется вместе со статьями.
+        namespaces = ['index', SITE]
+    slugs = Group.objects.filter(
+        pk__in=[pk for pk in group_ids if pk is not None]
+    ).values_list('slug', flat=True)
+    return namespaces + [f'post:{post.pk}'] + [
+        f'group:{slug}' for slug in slugs
+    ]
+
+
+def author_namespaces(user, *usernames):
+    """Карточка автора и страницы, где видно его имя."""
+    post_ids = set(
+        Post.objects.filter(author_id=user.pk).values_list('pk', flat=True)
+    ) | set(
+        Comment.objects.filter(author_id=user.pk)
+        .values_list('post_id', flat=True)
+    )
+    slugs = Group.objects.filter(
+        posts__author_id=user.pk
+    ).values_list('slug', flat=True).distinct()
+    return (
+        [card_namespace('author', user.pk), 'index']
+        + [f'profile:{username}' for username in dict.fromkeys(usernames)]
+        + [f'group:{slug}' for slug in slugs]
+        + [f'post:{pk}' for pk in sorted(post_ids)]
+    )
+
+
+@receiver(pre_save, sender=User)
+def user_pre_save(sender, instance, update_fields, **kwargs):
+    # Вход, смена пароля и прочие сохранения без выводимых полей кеш не
+    # трогают, поэтому старые значения читаются, только если поля могли
+    # измениться.
+    fields = USER_DISPLAY_FIELDS
+    if update_fields is not None:
+        fields = fields & set(update_fields)
+    instance._old_display = (
+        User.objects.filter(pk=instance.pk).values(*fields).first()
+        if instance.pk and fields else None
+    )
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    old = instance.__dict__.pop('_old_display', None)
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+    elif old and any(
+            getattr(instance, field) != value for field, value in old.items()):
+        bump_versions(*author_namespaces(
+            instance, old.get('username', instance.username),
+            instance.username,
+        ))
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # Комментарии и подписки могут быть в другой базе, куда каскад
+    # Django не дотягивается.
+    Comment.objects.filter(author_id=instance.pk).delete()
+    Follow.objects.filter(
+        Q(user_id=instance.pk) | Q(author_id=instance.pk)
+    ).delete()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    bump_versions(SITE, card_namespace('group', instance.pk))
+
+
+@receiver(pre_save, sender=Post)
+def post_pre_save(sender, instance, **kwargs):
+    old = (
+        Post.objects.filter(pk=instance.pk)
+        .values_list('group_id', 'image').first()
+        if instance.pk else None
+    )
+    instance._old_group_id, instance._old_image = old or (None, '')
+
+
+@receiver(pre_save, sender=Post)
+def post_image_changed(sender, instance, **kwargs):
+    # Новая загрузка ещё не сохранена в хранилище (_committed is False).
+    if not instance.image._committed or (
+            not instance.image and instance.image_hash):
+        images.fill_metadata(instance)
+    if instance.image and not instance.image._committed:
+        instance._acquired_image = images.acquire_upload(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        adjust_feed_counts([feed_count_key('all')], 1)
+        bump(UserStats, instance.author_id, posts_count=1)
+        bump(Group, instance.group_id, posts_count=1)
+        timeline.fan_out_post(instance)
+    elif instance._old_group_id != instance.group_id:
+        bump(Group, instance._old_group_id, posts_count=-1)
+        bump(Group, instance.group_id, posts_count=1)
+    # Ссылку на новую загрузку уже взял post_image_changed.
+    acquired = instance.__dict__.pop('_acquired_image', '')
+    image = instance.image.name or ''
+    if instance._old_image != image or acquired:
+        if acquired != image:
+            images.acquire(image)
+            images.release(acquired)
+        images.release(instance._old_image)
+    search.index_post(instance)
+    bump_versions(
+        card_namespace('post', instance.pk),
+        *page_namespaces(
+            instance, instance._old_group_id, instance.group_id
+        ),
+    )
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    Comment.objects.filter(post_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    adjust_feed_counts([feed_count_key('all')], -1)
+    bump(UserStats, instance.author_id, posts_count=-1)
+    bump(Group, instance.group_id, posts_count=-1)
+    search.unindex_post(instance.pk)
+    images.release(instance.image.name)
+    bump_versions(*page_namespaces(instance, instance.group_id))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, using, **kwargs):
+    def update():
+        if created:
+            bump(Post, instance.post_id, comments_count=1)
+        search.index_comment(instance)
+        bump_versions(f'post:{instance.post_id}')
+    writes.after_write(using, update)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, using, **kwargs):
+    def update():
+        bump(Post, instance.post_id, comments_count=-1)
+        search.unindex_comment(instance.pk)
+        bump_versions(f'post:{instance.post_id}')
+    writes.after_write(using, update)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, using, **kwargs):
+    if not created:
+        return
+
+    def update():
+        bump(UserStats, instance.author_id, followers_count=1)
+        bump(UserStats, instance.user_id, following_count=1)
+        timeline.mark_celebrity(instance.author_id)
+        timeline.backfill(instance)
+    writes.after_write(using, update)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, using, **kwargs):
+    def update():
+        bump(UserStats, instance.author_id, followers_count=-1)
+        bump(UserStats, instance.user_id, following_count=-1)
+        timeline.prune(instance)
+        timeline.schedule_restore(instance.author_id)
+    writes.after_write(using, update)
@@ -1,21 +1,43 @@
+import hashlib
+import os
 import shutil
 import tempfile
 
 from http import HTTPStatus
+from io import BytesIO, StringIO
+from unittest import mock
 
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 from django.conf import settings
 
-from posts.models import Post, User
+from core.cache import get_versions
+from posts import thumbnails, uploads
+from posts.cards import card_namespace
+from posts.forms import PostForm
+from posts.models import Post, Upload, User
 
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+PICTURE_CONTENT = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00'
+    b'\x01\x00\x00\x00\x00\x21\xf9\x04'
+    b'\x01\x0a\x00\x01\x00\x2c\x00\x00'
+    b'\x00\x00\x01\x00\x01\x00\x00\x02'
+    b'\x02\x4c\x01\x00\x3b'
+)
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostCreateFormTests(TestCase):
+    databases = '__all__'
+
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
@@ -59,10 +81,11 @@ class PostCreateFormTests(TestCase):
         )
         self.assertEqual(response.status_code, HTTPStatus.FOUND)
         self.assertEqual(Post.objects.count(), posts_count + 1)
+        digest = hashlib.sha256(picture_content).hexdigest()
         self.assertTrue(
             Post.objects.filter(
                 text='Пост с картинкой',
-                image='posts/picture.gif'
+                image=f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif'
             ).exists()
         )
 
@@ -80,3 +103,389 @@ class PostCreateFormTests(TestCase):
                 text='Тестовый текст изменен'
             ).exists()
         )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ThumbnailTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def thumbnail_files(self):
+        return sum(
+            len(files) for _, _, files in
+            os.walk(os.path.join(TEMP_MEDIA_ROOT, 'cache'))
+        )
+
+    def test_upload_schedules_thumbnails(self):
+        """Создание и правка картинки поста ставят миниатюры в очередь."""
+        with mock.patch('posts.thumbnails.schedule') as schedule:
+            self.authorized_client.post(reverse('posts:post_create'), {
+                'text': 'Пост с картинкой',
+                'image': SimpleUploadedFile(
+                    'thumb.gif', PICTURE_CONTENT, content_type='image/gif'),
+            })
+            post = Post.objects.get(text='Пост с картинкой')
+            schedule.assert_called_once_with(post.image.name)
+            schedule.reset_mock()
+            self.authorized_client.post(
+                reverse('posts:post_edit', args=(post.pk,)),
+                {'text': 'Только текст'},
+            )
+            schedule.assert_not_called()
+
+    def test_webp_variants_depend_on_pillow(self):
+        """WebP-варианты создаются, только если Pillow умеет WebP."""
+        for supported, formats in ((True, {None, 'WEBP'}), (False, {None})):
+            with mock.patch(
+                    'posts.thumbnails.features.check', return_value=supported):
+                variants = thumbnails.variants()
+            self.assertEqual(
+                {options.get('format') for _, _, options in variants},
+                formats,
+            )
+
+    def test_generate_and_rebuild_thumbnails(self):
+        """Миниатюры создаются для нужных размеров и командой rebuild."""
+        name = default_storage.save(
+            'posts/rebuild.gif', ContentFile(PICTURE_CONTENT))
+        thumbnails.generate(name)
+        created = self.thumbnail_files()
+        # Картинка меньше первой ширины: шире неё миниатюры не нужны.
+        self.assertEqual(created, len([
+            width for width, _, _ in thumbnails.variants()
+            if width <= settings.POST_THUMBNAIL_WIDTHS[0]
+        ]))
+        shutil.rmtree(os.path.join(TEMP_MEDIA_ROOT, 'cache'))
+        out = StringIO()
+        call_command(
+            'rebuild_thumbnails', workers=1, force=True, stdout=out)
+        self.assertEqual(self.thumbnail_files(), created)
+        self.assertIn('с ошибками: 0', out.getvalue())
+
+    def test_generation_refreshes_cached_cards(self):
+        """Созданные миниатюры сбрасывают закешированную карточку."""
+        post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile('card.gif', PICTURE_CONTENT),
+        )
+        namespace = card_namespace('post', post.pk)
+        before = get_versions([namespace])
+        thumbnails._submit(post.image.name)
+        self.assertNotEqual(get_versions([namespace]), before)
+        self.assertEqual(self.thumbnail_files(), len([
+            width for width, _, _ in thumbnails.variants()
+            if width <= settings.POST_THUMBNAIL_WIDTHS[0]
+        ]))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageMetadataTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.metadata = {
+            'image_width': 1,
+            'image_height': 1,
+            'image_format': 'GIF',
+            'image_size': len(PICTURE_CONTENT),
+            'image_hash': hashlib.sha256(PICTURE_CONTENT).hexdigest(),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def assertMetadata(self, post, metadata):
+        post.refresh_from_db()
+        for field, value in metadata.items():
+            with self.subTest(field=field):
+                self.assertEqual(getattr(post, field), value)
+
+    def test_upload_stores_metadata(self):
+        """Метаданные картинки сохраняются при загрузке и при удалении."""
+        post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile('meta.gif', PICTURE_CONTENT),
+        )
+        self.assertMetadata(post, self.metadata)
+        post.image = None
+        post.save()
+        self.assertMetadata(post, {
+            'image_width': None, 'image_format': '', 'image_hash': '',
+        })
+
+    def test_backfill_image_metadata(self):
+        """Команда дополняет метаданными уже загруженные картинки."""
+        name = default_storage.save(
+            'posts/old.gif', ContentFile(PICTURE_CONTENT))
+        post = Post.objects.create(author=self.user, text='Старый пост')
+        Post.objects.filter(pk=post.pk).update(image=name)
+        broken = Post.objects.create(author=self.user, text='Без файла')
+        Post.objects.filter(pk=broken.pk).update(image='posts/missing.gif')
+        out, err = StringIO(), StringIO()
+        call_command(
+            'backfill_image_metadata', chunk_size=1, stdout=out, stderr=err)
+        self.assertMetadata(post, self.metadata)
+        self.assertIn('Дополнено картинок: 1, с ошибками: 1', out.getvalue())
+        self.assertIn('posts/missing.gif', err.getvalue())
+
+
+class MediaGarbageTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        # Отдельный каталог: мусор других тестов не должен попасть в отчёт.
+        self.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        cache.clear()
+        user = User.objects.create_user(username='auth')
+        self.post = Post.objects.create(
+            author=user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile('used.gif', PICTURE_CONTENT),
+        )
+        thumbnails.generate(self.post.image.name)
+        self.orphan = default_storage.save(
+            'posts/orphan.gif', ContentFile(PICTURE_CONTENT))
+        before = self.files()
+        thumbnails.generate(self.orphan)
+        self.orphan_thumbnails = self.files() - before
+        self.stray = default_storage.save(
+            'cache/aa/bb/stray.jpg', ContentFile(b'stray'))
+        self.incoming = default_storage.save(
+            '.incoming/upload', ContentFile(b'part'))
+
+    def files(self):
+        return {
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root)
+            for name in names
+        }
+
+    def collect(self, **options):
+        out = StringIO()
+        call_command(
+            'collect_media_garbage', sleep=0, stdout=out, **options)
+        return out.getvalue()
+
+    def test_dry_run_and_min_age_keep_files(self):
+        """Пробный прогон и свежие файлы ничего не удаляют."""
+        before = self.files()
+        report = self.collect(dry_run=True, min_age=0)
+        self.assertIn('Картинки: будет удалено 1 файлов', report)
+        self.assertIn('Миниатюры: будет удалено 1 файлов', report)
+        self.assertIn('Недописанные загрузки: будет удалено 1 файлов', report)
+        self.assertIn('Картинки: удалено 0 файлов', self.collect())
+        self.assertEqual(self.files(), before)
+
+    def test_unreferenced_files_are_deleted(self):
+        """Удаляются только файлы, на которые ничего не ссылается."""
+        before = self.files()
+        self.collect(min_age=0, batch_size=1)
+        removed = before - self.files()
+        self.assertIn(self.orphan, removed)
+        self.assertIn(self.stray, removed)
+        self.assertIn(self.incoming, removed)
+        self.assertIn(self.post.image.name, self.files())
+        # Кроме мусора ушли только миниатюры удалённой картинки.
+        self.assertEqual(len(removed), 3 + len(self.orphan_thumbnails))
+        self.post.refresh_from_db()
+        thumbnails.attach([self.post])
+        self.assertIsNotNone(self.post.thumbnail)
+
+
+@override_settings(POST_IMAGE_MAX_SIDE=100)
+class ImageNormalizationTests(TestCase):
+    databases = '__all__'
+
+    @staticmethod
+    def upload(size, image_format, name, **options):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, image_format, **options)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def clean(self, upload):
+        form = PostForm({'text': 'Текст'}, {'image': upload})
+        form.is_valid()
+        return form
+
+    def test_large_jpeg_is_downsized_without_exif(self):
+        """Большой JPEG уменьшается, теряет EXIF и становится progressive."""
+        exif = Image.Exif()
+        exif[0x0110] = 'Камера'
+        form = self.clean(
+            self.upload((400, 200), 'JPEG', 'photo.jpeg', exif=exif))
+        self.assertTrue(form.is_valid(), form.errors)
+        image_file = form.cleaned_data['image']
+        self.assertEqual(image_file.name, 'photo.jpg')
+        with Image.open(image_file) as image:
+            self.assertEqual(image.size, (100, 50))
+            self.assertNotIn('exif', image.info)
+            self.assertTrue(image.info.get('progressive'))
+
+    def test_large_gif_becomes_jpeg_small_gif_is_kept(self):
+        """Крупный GIF перекодируется, небольшой сохраняется как есть."""
+        small = self.upload((10, 10), 'GIF', 'small.gif')
+        self.assertIs(self.clean(small).cleaned_data['image'], small)
+        large = self.clean(self.upload((300, 300), 'GIF', 'large.gif'))
+        self.assertEqual(large.cleaned_data['image'].name, 'large.jpg')
+
+    def test_small_tiff_is_reencoded_without_exif(self):
+        """Небольшая картинка не в JPEG/PNG/GIF тоже теряет EXIF."""
+        exif = Image.Exif()
+        exif[0x0110] = 'Камера'
+        upload = self.upload((20, 20), 'TIFF', 'scan.tiff', exif=exif)
+        image_file = self.clean(upload).cleaned_data['image']
+        self.assertEqual(image_file.name, 'scan.jpg')
+        with Image.open(image_file) as image:
+            self.assertNotIn('exif', image.info)
+
+    def test_limits_reject_uploads(self):
+        """Слишком тяжёлые или крупные картинки не принимаются."""
+        for setting, code in (
+                ({'POST_IMAGE_MAX_BYTES': 10}, 'file_too_large'),
+                ({'POST_IMAGE_MAX_PIXELS': 100}, 'too_many_pixels')):
+            with self.subTest(code=code), self.settings(**setting):
+                form = self.clean(self.upload((20, 20), 'PNG', 'big.png'))
+                self.assertTrue(form.has_error('image', code))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ChunkedUploadTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def start(self, content):
+        response = self.client.post(
+            reverse('posts:upload_create'),
+            {'filename': 'small.gif', 'size': len(content)},
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        return response.json()['id']
+
+    def send(self, upload_id, content, first, last):
+        return self.client.post(
+            reverse('posts:upload_chunk', args=[upload_id]),
+            content[first:last + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {first}-{last}/{len(content)}',
+        )
+
+    def test_upload_resumes_from_offset(self):
+        """Части принимаются по порядку, после обрыва — с offset."""
+        upload_id = self.start(PICTURE_CONTENT)
+        self.assertEqual(self.send(upload_id, PICTURE_CONTENT, 0, 9).json(),
+                         {'id': upload_id, 'offset': 10, 'complete': False})
+        response = self.send(upload_id, PICTURE_CONTENT, 5, 20)
+        self.assertEqual(response.status_code, HTTPStatus.CONFLICT)
+        self.assertEqual(response.json()['offset'], 10)
+        status = self.client.get(
+            reverse('posts:upload_chunk', args=[upload_id])).json()
+        last = len(PICTURE_CONTENT) - 1
+        status = self.send(
+            upload_id, PICTURE_CONTENT, status['offset'], last).json()
+        self.assertTrue(status['complete'])
+        response = self.send(upload_id, PICTURE_CONTENT, 0, last + 5)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_concurrent_retry_of_part_is_rejected(self):
+        """Повтор части, уже принятой параллельно, не портит файл."""
+        upload_id = self.start(PICTURE_CONTENT)
+        stale = Upload.objects.get(pk=upload_id)
+        self.send(upload_id, PICTURE_CONTENT, 0, 9)
+        with self.assertRaises(uploads.OffsetMismatch):
+            uploads.append(stale, BytesIO(b'x' * 10), 0, 10)
+        with open(uploads.part_path(stale), 'rb') as part:
+            self.assertEqual(part.read(), PICTURE_CONTENT[:10])
+        self.assertEqual(Upload.objects.get(pk=upload_id).offset, 10)
+
+    def test_foreign_and_oversized_uploads(self):
+        """Чужая загрузка не видна, слишком большой файл не начинается."""
+        upload_id = self.start(PICTURE_CONTENT)
+        self.client.force_login(User.objects.create_user(username='other'))
+        response = self.client.get(
+            reverse('posts:upload_chunk', args=[upload_id]))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        with self.settings(POST_IMAGE_MAX_BYTES=10):
+            response = self.client.post(
+                reverse('posts:upload_create'),
+                {'filename': 'big.gif', 'size': 11},
+            )
+        self.assertEqual(
+            response.status_code, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+    def test_post_uses_completed_upload(self):
+        """Форма статьи берёт картинку из завершённой загрузки."""
+        upload_id = self.start(PICTURE_CONTENT)
+        self.send(upload_id, PICTURE_CONTENT, 0, len(PICTURE_CONTENT) - 1)
+        upload = Upload.objects.get(pk=upload_id)
+        part = uploads.part_path(upload)
+        self.client.post(
+            reverse('posts:post_create'),
+            {'text': 'Статья с загрузкой', 'upload_id': upload_id},
+        )
+        digest = hashlib.sha256(PICTURE_CONTENT).hexdigest()
+        self.assertEqual(
+            Post.objects.get(text='Статья с загрузкой').image.name,
+            f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif'
+        )
+        self.assertFalse(Upload.objects.filter(pk=upload_id).exists())
+        self.assertFalse(os.path.exists(part))
+
+    def test_invalid_form_closes_upload_part(self):
+        """Файл загрузки открывается по пути и закрывается без статьи."""
+        upload_id = self.start(PICTURE_CONTENT)
+        self.send(upload_id, PICTURE_CONTENT, 0, len(PICTURE_CONTENT) - 1)
+        opened = []
+
+        def track(*args):
+            opened.append(open(*args))
+            return opened[-1]
+
+        with mock.patch('posts.uploads.open', side_effect=track,
+                        create=True), \
+                mock.patch.object(
+                    uploads.UploadedPart, 'temporary_file_path',
+                    autospec=True, side_effect=lambda part: part.file.name,
+                ) as temporary_file_path:
+            response = self.client.post(
+                reverse('posts:post_create'),
+                {'text': '', 'upload_id': upload_id},
+            )
+        self.assertFormError(response, 'form', 'text', 'Обязательное поле.')
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+        temporary_file_path.assert_called()
+        self.assertTrue(Upload.objects.filter(pk=upload_id).exists())
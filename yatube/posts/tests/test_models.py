@@ -1,9 +1,27 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 
-from posts.models import Group, Post, User
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+
+from core.storage import ContentAddressedStorage
+from posts import images
+from posts.models import (
+    Comment, Follow, Group, Post, StoredImage, User, UserStats)
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
 class PostModelTest(TestCase):
+    databases = '__all__'
+
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
@@ -56,3 +74,145 @@ class PostModelTest(TestCase):
         max_length_slug = group._meta.get_field('slug').max_length
         length_slug = len(group.slug)
         self.assertEqual(max_length_slug, length_slug)
+
+
+class CountersTest(TransactionTestCase):
+    # Комментарии и подписки могут жить в отдельной базе (core.hot), тогда
+    # счётчики обновляются после фиксации её транзакции.
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='auth')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            description='Тестовое описание',
+        )
+        self.other_group = Group.objects.create(
+            title='Другая группа',
+            description='Тестовое описание',
+        )
+
+    def refresh(self):
+        for obj in (self.user.stats, self.reader.stats,
+                    self.group, self.other_group):
+            obj.refresh_from_db()
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются вместе со статьями, комментариями и подписками."""
+        post = Post.objects.create(
+            author=self.user, text='Текст', group=self.group)
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        Follow.objects.create(user=self.reader, author=self.user)
+        self.refresh()
+        post.refresh_from_db()
+        self.assertEqual(self.user.stats.posts_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.user.stats.followers_count, 1)
+        self.assertEqual(self.reader.stats.following_count, 1)
+        post.group = self.other_group
+        post.save()
+        self.refresh()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.other_group.posts_count, 1)
+        post.delete()
+        Follow.objects.all().delete()
+        self.refresh()
+        self.assertEqual(self.user.stats.posts_count, 0)
+        self.assertEqual(self.other_group.posts_count, 0)
+        self.assertEqual(self.user.stats.followers_count, 0)
+        self.assertEqual(self.reader.stats.following_count, 0)
+
+    def test_reconcile_counters_fixes_drift(self):
+        """Команда reconcile_counters исправляет разошедшиеся счётчики."""
+        post = Post.objects.create(
+            author=self.user, text='Текст', group=self.group)
+        UserStats.objects.update(posts_count=7)
+        Group.objects.update(posts_count=5)
+        Post.objects.update(comments_count=3)
+        call_command('reconcile_counters', chunk_size=1, stdout=StringIO())
+        self.refresh()
+        post.refresh_from_db()
+        self.assertEqual(self.user.stats.posts_count, 1)
+        self.assertEqual(self.reader.stats.posts_count, 0)
+        self.assertEqual(self.group.posts_count, 1)
+        self.assertEqual(self.other_group.posts_count, 0)
+        self.assertEqual(post.comments_count, 0)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class StoredImageTest(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    @staticmethod
+    def gif(color):
+        buffer = BytesIO()
+        Image.new('RGB', (2, 2), color).save(buffer, 'GIF')
+        return buffer.getvalue()
+
+    def create_post(self, content):
+        return Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile('image.gif', content),
+        )
+
+    def references(self, name):
+        return StoredImage.objects.filter(name=name).values_list(
+            'references', flat=True).first()
+
+    def test_file_is_deleted_with_last_reference(self):
+        """Общий файл удаляется, только когда на него не ссылаются."""
+        first = self.create_post(self.gif('red'))
+        second = self.create_post(self.gif('red'))
+        name = first.image.name
+        storage = first.image.storage
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(self.references(name), 2)
+        first.delete()
+        self.assertEqual(self.references(name), 1)
+        self.assertTrue(storage.exists(name))
+        second.image = SimpleUploadedFile('new.gif', self.gif('blue'))
+        second.save()
+        self.assertIsNone(self.references(name))
+        self.assertFalse(storage.exists(name))
+        self.assertEqual(self.references(second.image.name), 1)
+
+    def test_upload_reference_is_taken_before_file_reuse(self):
+        """Параллельное удаление не забирает файл у новой загрузки."""
+        first = self.create_post(self.gif('red'))
+        name = first.image.name
+        storage = first.image.storage
+        save = ContentAddressedStorage._save
+
+        def save_and_delete(self, *args):
+            saved = save(self, *args)
+            # Удаление после release другой статьи успело между
+            # проверкой файла и сохранением новой статьи.
+            images.delete_if_unused(saved)
+            return saved
+
+        with transaction.atomic():
+            first.delete()
+            with mock.patch.object(
+                    ContentAddressedStorage, '_save', save_and_delete):
+                second = self.create_post(self.gif('red'))
+        self.assertEqual(second.image.name, name)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(self.references(name), 1)
+
+    def test_reconcile_fixes_references(self):
+        """reconcile_counters исправляет число ссылок на файл."""
+        name = self.create_post(self.gif('red')).image.name
+        StoredImage.objects.filter(name=name).update(references=5)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(self.references(name), 1)
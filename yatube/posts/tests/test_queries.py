@@ -0,0 +1,166 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import thumbnails
+from posts.models import Comment, Follow, Group, Post, User
+
+
+# Наибольшее число запросов на страницу. Для авторизованного клиента
+# сюда входят запросы сессии и пользователя. Подписки и комментарии
+# могут быть в отдельной базе (core.hot), поэтому профиль, лента подписок
+# и страница поста читают их отдельным запросом, а не через JOIN.
+QUERY_BUDGET = {
+    'index': 3,
+    'group': 4,
+    'profile': 6,
+    'follow_index': 6,
+    'post_detail': 5,
+}
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+PICTURE_CONTENT = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00'
+    b'\x01\x00\x00\x00\x00\x21\xf9\x04'
+    b'\x01\x0a\x00\x01\x00\x2c\x00\x00'
+    b'\x00\x00\x01\x00\x01\x00\x00\x02'
+    b'\x02\x4c\x01\x00\x3b'
+)
+
+
+class QueryBudgetTest(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.user)
+        cls.post = cls.create_posts(1)[0]
+        cls.urls = {
+            'index': reverse('posts:index'),
+            'group': reverse('posts:group_list', args={'test'}),
+            'profile': reverse('posts:profile', args={'auth'}),
+            'follow_index': reverse('posts:follow_index'),
+            'post_detail': reverse('posts:post_detail', args={cls.post.pk}),
+        }
+
+    @classmethod
+    def create_posts(cls, number):
+        return [
+            Post.objects.create(
+                author=cls.user, group=cls.group, text=f'Пост {i}')
+            for i in range(number)
+        ]
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def count_queries(self, url_label):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.urls[url_label])
+        return len(context.captured_queries)
+
+    def test_feed_queries_do_not_grow_with_page_size(self):
+        """Число запросов ленты не зависит от числа статей на странице."""
+        labels = ('index', 'group', 'profile', 'follow_index')
+        before = {label: self.count_queries(label) for label in labels}
+        self.create_posts(9)
+        for label in labels:
+            with self.subTest(page=label):
+                after = self.count_queries(label)
+                self.assertEqual(after, before[label])
+                self.assertLessEqual(after, QUERY_BUDGET[label])
+
+    def test_post_detail_queries_do_not_grow_with_comments(self):
+        """Число запросов страницы поста не зависит от комментариев."""
+        Comment.objects.create(post=self.post, author=self.reader, text='1')
+        before = self.count_queries('post_detail')
+        for i in range(9):
+            Comment.objects.create(
+                post=self.post, author=self.user, text=f'Ещё {i}')
+        after = self.count_queries('post_detail')
+        self.assertEqual(after, before)
+        self.assertLessEqual(after, QUERY_BUDGET['post_detail'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailLookupTest(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.posts = [
+            Post.objects.create(
+                author=cls.user,
+                text=f'Пост {i}',
+                image=SimpleUploadedFile(f'feed{i}.gif', PICTURE_CONTENT),
+            )
+            for i in range(3)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Кеш sorl не откатывается вместе с базой между тестами.
+        cache.clear()
+
+    def kvstore_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('posts:index'))
+        queries = [
+            query for query in context.captured_queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        return response, len(queries)
+
+    def test_feed_thumbnails_are_fetched_in_one_query(self):
+        """Миниатюры ленты читаются из хранилища sorl одним запросом."""
+        for post in self.posts:
+            thumbnails.generate(post.image.name)
+        response, queries = self.kvstore_queries()
+        self.assertEqual(queries, 1)
+        for post in response.context['page_obj']:
+            self.assertIsNotNone(post.thumbnail)
+            self.assertContains(response, post.thumbnail.url)
+
+    def test_feed_images_have_srcset_and_lazy_loading(self):
+        """Картинки ленты выводятся с srcset, ниже первой — лениво."""
+        for post in self.posts:
+            thumbnails.generate(post.image.name)
+        response, _ = self.kvstore_queries()
+        post = response.context['page_obj'][0]
+        self.assertIn(' 480w, ', post.srcset)
+        self.assertTrue(post.srcset.endswith(' 960w'))
+        # Исходная картинка уже 960 пикселей, 1440w не предлагается.
+        self.assertNotIn('1440w', post.srcset)
+        self.assertContains(response, 'srcset="', count=3)
+        self.assertContains(response, 'loading="lazy"', count=2)
+
+    def test_missing_thumbnail_falls_back_to_tag(self):
+        """Миниатюра, которой нет в хранилище, создаётся тегом."""
+        response, _ = self.kvstore_queries()
+        page = response.context['page_obj']
+        self.assertEqual([post.thumbnail for post in page], [None] * 3)
+        self.assertContains(response, '<img class="card-img', count=3)
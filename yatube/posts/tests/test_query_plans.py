@@ -0,0 +1,117 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, User
+from posts.paginators import CursorPaginator
+
+
+def plan_problems(sql):
+    """Строки плана запроса с просмотром таблицы или сортировкой.
+
+    Допустим только SEARCH — поиск по ключу индекса. «SCAN таблица»
+    проходит таблицу с начала, даже если идёт по индексу, и
+    останавливается на LIMIT, только когда подходящие строки попадаются
+    сразу; «USE TEMP B-TREE» сортирует всю выборку.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        details = [row[-1] for row in cursor.fetchall()]
+    return [
+        detail for detail in details
+        if 'TEMP B-TREE' in detail
+        or (detail.startswith('SCAN') and detail != 'SCAN CONSTANT ROW')
+    ]
+
+
+# Первая страница общей ленты — проход индекса pub_date с начала: каждая
+# строка подходит, и SQLite останавливается на LIMIT после 11 строк.
+ORDERED_SCANS = {
+    'index': 'SCAN posts_post USING INDEX posts_post_pub_date_',
+}
+
+
+class QueryPlanTest(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.user)
+        posts = [
+            Post.objects.create(
+                author=cls.user, group=cls.group, text=f'Пост {i}')
+            for i in range(12)
+        ]
+        cls.post = posts[0]
+        Comment.objects.create(post=cls.post, author=cls.reader, text='Ок')
+        cursor = CursorPaginator(Post.objects.all(), 10).encode_cursor(
+            posts[5])
+        cls.pages = {}
+        for label, url in (
+                ('index', reverse('posts:index')),
+                ('group', reverse('posts:group_list', args=['test'])),
+                ('profile', reverse('posts:profile', args=['auth'])),
+                ('follow_index', reverse('posts:follow_index'))):
+            cls.pages[label] = url
+            cls.pages[f'{label} (after)'] = f'{url}?after={cursor}'
+        cls.pages['post_detail'] = reverse(
+            'posts:post_detail', args=[cls.post.pk])
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def assertUsesIndexes(self, send, allowed_scan=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            send()
+        for query in context.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                problems = [
+                    problem for problem in plan_problems(query['sql'])
+                    if not allowed_scan or not problem.startswith(
+                        allowed_scan)
+                ]
+                self.assertEqual(problems, [], query['sql'])
+
+    def test_pages_use_indexes(self):
+        """Запросы лент и страницы поста не просматривают таблицы целиком."""
+        for label, url in self.pages.items():
+            with self.subTest(page=label):
+                self.assertUsesIndexes(
+                    lambda: self.client.get(url), ORDERED_SCANS.get(label))
+
+    @override_settings(FOLLOW_FANOUT_THRESHOLD=0)
+    def test_follow_feed_with_celebrities_uses_indexes(self):
+        """Статьи популярных авторов подмешиваются поиском по индексу."""
+        for label in ('follow_index', 'follow_index (after)'):
+            with self.subTest(page=label):
+                self.assertUsesIndexes(
+                    lambda: self.client.get(self.pages[label]))
+
+    def test_writes_use_indexes(self):
+        """Публикация, комментарий и подписка читают только по индексам."""
+        self.client.force_login(self.user)
+        requests = {
+            'post_create': (reverse('posts:post_create'), {'text': 'Ещё'}),
+            'add_comment': (
+                reverse('posts:add_comment', args=[self.post.pk]),
+                {'text': 'Ещё'},
+            ),
+            'profile_follow': (
+                reverse('posts:profile_follow', args=['reader']), None),
+        }
+        for label, (url, data) in requests.items():
+            with self.subTest(view=label):
+                self.assertUsesIndexes(
+                    lambda: self.client.post(url, data) if data
+                    else self.client.get(url))
@@ -8,6 +8,8 @@ from posts.models import Group, Post, User
 
 
 class StaticURLTests(TestCase):
+    databases = '__all__'
+
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
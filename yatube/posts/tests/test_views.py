@@ -1,17 +1,25 @@
 import tempfile
 import shutil
 
+from base64 import urlsafe_b64encode
 from http import HTTPStatus
+from io import StringIO
+from unittest import mock
 
 from django import forms
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings)
 from django.urls import reverse
 from django.core.cache import cache
 from django.conf import settings
 
 
-from posts.models import Post, Group, User, Comment, Follow
+from posts import search, timeline
+from posts.models import (
+    Post, Group, User, Comment, Follow, TimelineEntry, UserStats)
+from posts.paginators import ELLIPSIS, CursorPaginator, feed_count_key
 
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -19,6 +27,8 @@ TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostPagesTests(TestCase):
+    databases = '__all__'
+
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
@@ -231,3 +241,414 @@ class PostPagesTests(TestCase):
         '''Переадресация гостя на логин при комментировании поста '''
         response = self.guest_client.post(self.HOME_URL['add_comment'])
         self.assertEqual(response.status_code, HTTPStatus.FOUND)
+
+
+class PaginatorViewsTest(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test',
+            description='Тестовое описание',
+        )
+        for i in range(13):
+            Post.objects.create(
+                author=cls.user, group=cls.group, text=f'Пост {i}')
+        cls.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args={'test'}),
+            reverse('posts:profile', args={'auth'}),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_cursor_pages(self):
+        """Курсорные ссылки ведут на следующую и предыдущую страницы."""
+        for url in self.urls:
+            with self.subTest(url=url):
+                first = self.guest_client.get(url).context['page_obj']
+                self.assertEqual(len(first), 10)
+                self.assertIsNone(first.previous_cursor)
+                second = self.guest_client.get(
+                    url, {'after': first.next_cursor}
+                ).context['page_obj']
+                self.assertEqual(len(second), 3)
+                self.assertIsNone(second.next_cursor)
+                back = self.guest_client.get(
+                    url, {'before': second.previous_cursor}
+                ).context['page_obj']
+                self.assertEqual(list(back), list(first))
+
+    def test_page_number_still_works(self):
+        """Старые ссылки ?page=N продолжают работать."""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url, {'page': 2})
+                self.assertEqual(len(response.context['page_obj']), 3)
+
+    def test_count_is_cached_and_maintained(self):
+        """Число статей берётся из кеша и меняется вместе со статьями."""
+        url = self.urls[0]
+        self.guest_client.get(url, {'page': 1})
+        key = feed_count_key('all')
+        self.assertEqual(cache.get(key), 13)
+        Post.objects.create(author=self.user, group=self.group, text='Ещё')
+        self.assertEqual(cache.get(key), 14)
+        Post.objects.filter(text='Ещё').delete()
+        response = self.guest_client.get(url, {'page': 2})
+        with self.assertNumQueries(0):
+            self.assertEqual(response.context['page_obj'].paginator.count, 13)
+
+    def test_elided_page_range(self):
+        """Вместо всех номеров страниц выводится окно вокруг текущей."""
+        paginator = CursorPaginator(Post.objects.all(), 1)
+        self.assertEqual(
+            list(paginator.get_elided_page_range(7)),
+            [1, ELLIPSIS, 5, 6, 7, 8, 9, ELLIPSIS, 13],
+        )
+        self.assertEqual(
+            list(paginator.get_elided_page_range(2)),
+            [1, 2, 3, 4, ELLIPSIS, 13],
+        )
+
+    def test_broken_cursor_returns_first_page(self):
+        """Испорченный курсор отдаёт первую страницу."""
+        response = self.guest_client.get(self.urls[0], {'after': '%%%'})
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+    def test_out_of_range_cursor_returns_first_page(self):
+        """Огромный pk и время без пояса в курсоре дают первую страницу."""
+        for raw in ('2026-01-01T00:00:00+00:00|' + '9' * 30,
+                    '2026-01-01T00:00:00|5'):
+            token = urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+            with self.subTest(cursor=raw):
+                response = self.guest_client.get(
+                    self.urls[0], {'after': token})
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                page = response.context['page_obj']
+                self.assertEqual(page.number, 1)
+                self.assertIsNone(page.previous_cursor)
+
+
+@override_settings(TIMELINE_WORKERS=0)
+class TimelineTest(TransactionTestCase):
+    # Подписки могут жить в отдельной базе (core.hot), тогда ленты
+    # обновляются после фиксации её транзакции.
+    databases = '__all__'
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.star = User.objects.create_user(username='star')
+        self.user = User.objects.create_user(username='reader')
+        self.old_post = Post.objects.create(author=self.author, text='Старый')
+        self.star_post = Post.objects.create(author=self.star, text='Звезда')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def get_feed(self):
+        response = self.client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Подписка заполняет ленту, отписка очищает её."""
+        self.client.get(
+            reverse('posts:profile_follow', args={'author'}))
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        self.assertEqual(self.get_feed(), [new_post, self.old_post])
+        self.assertEqual(self.user.timeline.count(), 2)
+        self.client.get(
+            reverse('posts:profile_unfollow', args={'author'}))
+        self.assertEqual(self.get_feed(), [])
+        self.assertFalse(self.user.timeline.exists())
+
+    @override_settings(FOLLOW_FANOUT_THRESHOLD=0)
+    def test_celebrity_posts_merged_on_read(self):
+        """Статьи популярных авторов не раскладываются, а подмешиваются."""
+        Follow.objects.create(user=self.user, author=self.star)
+        new_post = Post.objects.create(author=self.star, text='Новая')
+        self.assertFalse(self.user.timeline.filter(post=new_post).exists())
+        self.assertEqual(self.get_feed(), [new_post, self.star_post])
+
+    @override_settings(FOLLOW_FANOUT_THRESHOLD=1)
+    def test_cursor_pages_merge_timeline_and_celebrities(self):
+        """Курсорные страницы сливают ленту и статьи популярных авторов."""
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=other, author=self.star)
+        Follow.objects.create(user=self.user, author=self.star)
+        Follow.objects.create(user=self.user, author=self.author)
+        for i in range(6):
+            Post.objects.create(author=self.author, text=f'Автор {i}')
+            Post.objects.create(author=self.star, text=f'Звезда {i}')
+        expected = list(Post.objects.filter(
+            author__in=[self.author, self.star]
+        ).order_by('-pub_date', '-pk'))
+        url = reverse('posts:follow_index')
+        first = self.client.get(url).context['page_obj']
+        second = self.client.get(
+            url, {'after': first.next_cursor}).context['page_obj']
+        self.assertEqual(list(first) + list(second), expected)
+        self.assertIsNone(second.next_cursor)
+        back = self.client.get(
+            url, {'before': second.previous_cursor}).context['page_obj']
+        self.assertEqual(list(back), list(first))
+
+    @override_settings(FOLLOW_FANOUT_THRESHOLD=1)
+    def test_posts_kept_when_author_drops_to_threshold(self):
+        """Статьи автора остаются в ленте, когда он опускается до порога."""
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.user, author=self.star)
+        Follow.objects.create(user=other, author=self.star)
+        stats = UserStats.objects.get(pk=self.star.pk)
+        self.assertIsNotNone(stats.celebrity_since)
+        new_post = Post.objects.create(author=self.star, text='Новая')
+        self.assertFalse(self.user.timeline.filter(post=new_post).exists())
+        with mock.patch('posts.timeline._submit') as submit:
+            Follow.objects.get(user=other, author=self.star).delete()
+        submit.assert_called_once_with(self.star.pk)
+        # Пока раскладка не прошла, статьи подмешиваются при чтении.
+        self.assertFalse(self.user.timeline.filter(post=new_post).exists())
+        self.assertEqual(self.get_feed(), [new_post, self.star_post])
+        timeline.restore_fan_out(self.star.pk)
+        self.assertEqual(self.user.timeline.count(), 2)
+        stats.refresh_from_db()
+        self.assertIsNone(stats.celebrity_since)
+        self.assertEqual(self.get_feed(), [new_post, self.star_post])
+
+    @override_settings(FOLLOW_FANOUT_THRESHOLD=1)
+    def test_restore_fans_out_only_posts_since_crossing(self):
+        """Раскладка после ухода под порог берёт только новые статьи."""
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.user, author=self.star)
+        Follow.objects.create(user=other, author=self.star)
+        new_post = Post.objects.create(author=self.star, text='Новая')
+        with mock.patch('posts.timeline._submit'):
+            Follow.objects.get(user=other, author=self.star).delete()
+        TimelineEntry.objects.filter(post=self.star_post).delete()
+        timeline.restore_fan_out(self.star.pk)
+        self.assertEqual(
+            list(self.user.timeline.values_list('post', flat=True)),
+            [new_post.pk],
+        )
+
+
+class PageCacheTest(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text='Первая статья')
+        cls.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args={'test'}),
+            reverse('posts:profile', args={'auth'}),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_pages_are_cached_until_data_changes(self):
+        """Кеш страниц сбрасывается при создании, правке и удалении."""
+        for url in self.urls:
+            self.guest_client.get(url)
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигнала')
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertContains(response, 'Первая статья')
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Исправленная статья'
+        post.save()
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertContains(response, 'Исправленная статья')
+        post.delete()
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertNotContains(response, 'Исправленная статья')
+
+    def test_group_rename_resets_cache(self):
+        """Переименование группы сбрасывает кеш всех страниц."""
+        self.guest_client.get(self.urls[0])
+        self.group.title = 'Новое название'
+        self.group.save()
+        response = self.guest_client.get(self.urls[0])
+        self.assertContains(response, 'Новое название')
+
+    def test_post_cards_are_cached_until_versions_change(self):
+        """Карточка статьи сбрасывается при правке статьи, группы, автора."""
+        client = Client()
+        client.force_login(self.user)
+        client.get(self.urls[0])
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигнала')
+        response = client.get(self.urls[0])
+        self.assertContains(response, 'Первая статья')
+        Post.objects.get(pk=self.post.pk).save()
+        self.assertContains(client.get(self.urls[0]), 'Без сигнала')
+        self.group.title = 'Новое название'
+        self.group.save()
+        self.assertContains(client.get(self.urls[0]), 'Новое название')
+        self.user.first_name = 'Лев'
+        self.user.save()
+        self.assertContains(client.get(self.urls[0]), 'Лев')
+
+    def test_user_saves_reset_cache_only_on_rename(self):
+        """Кеш страниц сбрасывается, только когда меняется имя автора."""
+        for url in self.urls:
+            self.guest_client.get(url)
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигнала')
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('new-password')
+        user.save()
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.guest_client.get(url), 'Первая статья')
+        user.username = 'renamed'
+        user.save()
+        urls = self.urls[:2] + (reverse('posts:profile', args={'renamed'}),)
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertContains(response, 'Без сигнала')
+                self.assertContains(response, 'renamed')
+
+    def test_authorized_users_share_cached_skeleton(self):
+        """Авторизованный получает общий каркас со своими фрагментами."""
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.user)
+        client = Client()
+        client.force_login(reader)
+        self.guest_client.get(self.urls[2])
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигнала')
+        response = client.get(self.urls[2])
+        self.assertContains(response, 'Первая статья')
+        self.assertContains(response, 'Пользователь: reader')
+        self.assertContains(response, 'Отписаться')
+        self.assertNotContains(response, '<!--hole:')
+        response = self.guest_client.get(self.urls[2])
+        self.assertNotContains(response, 'Пользователь: reader')
+        self.assertContains(response, 'Подписаться')
+
+    def test_post_detail_actions_are_personal(self):
+        """Форма комментария и правка видны только тем, кому положено."""
+        url = reverse('posts:post_detail', args={self.post.pk})
+        edit_url = reverse('posts:post_edit', args={self.post.pk})
+        response = self.guest_client.get(url)
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+        author_client = Client()
+        author_client.force_login(self.user)
+        response = author_client.get(url)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertContains(response, edit_url)
+        reader_client = Client()
+        reader_client.force_login(User.objects.create_user(username='reader'))
+        response = reader_client.get(url)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertNotContains(response, edit_url)
+
+    def test_new_comment_resets_post_page(self):
+        """Новый комментарий сбрасывает кеш страницы поста."""
+        url = reverse('posts:post_detail', args={self.post.pk})
+        self.guest_client.get(url)
+        Comment.objects.create(post=self.post, author=self.user, text='Ура')
+        self.assertContains(self.guest_client.get(url), 'Ура')
+
+
+class SearchTest(TransactionTestCase):
+    # Комментарии могут жить в отдельной базе (core.hot), тогда индекс
+    # обновляется после фиксации её транзакции.
+    databases = '__all__'
+
+    def setUp(self):
+        # Таблицу FTS очистка базы между тестами не трогает.
+        search.clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='auth')
+        self.url = reverse('posts:search')
+        self.guest_client = Client()
+
+    def found(self, query, **params):
+        response = self.guest_client.get(self.url, {'q': query, **params})
+        return [post.pk for post in response.context['page_obj']]
+
+    def test_search_finds_posts_by_text_and_comments(self):
+        """Поиск находит статью по её тексту и по комментариям."""
+        by_text = Post.objects.create(author=self.user, text='Зелёный чай')
+        by_comment = Post.objects.create(author=self.user, text='Напитки')
+        Post.objects.create(author=self.user, text='Кофе')
+        Comment.objects.create(
+            post=by_comment, author=self.user, text='Люблю чайные листья')
+        self.assertCountEqual(
+            self.found('чай'), [by_text.pk, by_comment.pk])
+        self.assertEqual(self.found('зелёный ЧАЙ'), [by_text.pk])
+        self.assertEqual(self.found('"; DROP'), [])
+        self.assertEqual(self.found(''), [])
+
+    def test_search_index_follows_changes(self):
+        """Правка и удаление статьи или комментария меняют выдачу."""
+        post = Post.objects.create(author=self.user, text='Старый текст')
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='Комментарий про море')
+        self.assertEqual(self.found('море'), [post.pk])
+        comment.delete()
+        self.assertEqual(self.found('море'), [])
+        post.text = 'Новый текст'
+        post.save()
+        self.assertEqual(self.found('старый'), [])
+        self.assertEqual(self.found('новый'), [post.pk])
+        Post.objects.get(pk=post.pk).delete()
+        self.assertEqual(self.found('новый'), [])
+
+    def test_search_is_ranked_and_paginated(self):
+        """Релевантные статьи идут первыми, страницы сохраняют запрос."""
+        best = Post.objects.create(author=self.user, text='кот кот кот')
+        for i in range(10):
+            Post.objects.create(
+                author=self.user,
+                text=f'Длинная статья номер {i}, в которой есть кот',
+            )
+        self.assertEqual(self.found('кот')[0], best.pk)
+        self.assertEqual(len(self.found('кот', page=2)), 1)
+        response = self.guest_client.get(self.url, {'q': 'кот'})
+        self.assertContains(response, '?q=%D0%BA%D0%BE%D1%82&amp;page=2')
+
+    @override_settings(
+        DEBUG=True, ROOT_URLCONF='posts.tests.debug_urls')
+    def test_index_writes_under_debug_toolbar(self):
+        """Запись в индекс не ломает панель SQL в debug_toolbar."""
+        client = Client(REMOTE_ADDR='127.0.0.1')
+        client.force_login(self.user)
+        response = client.post(
+            reverse('posts:post_create'), {'text': 'Под отладкой'})
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        post = Post.objects.get(text='Под отладкой')
+        client.post(
+            reverse('posts:add_comment', args=[post.pk]),
+            {'text': 'Комментарий под отладкой'},
+        )
+        self.assertEqual(self.found('отладкой'), [post.pk])
+
+    def test_rebuild_search_index(self):
+        """Команда восстанавливает индекс с нуля."""
+        post = Post.objects.create(author=self.user, text='Индекс')
+        search.clear()
+        self.assertEqual(self.found('индекс'), [])
+        call_command('rebuild_search_index', chunk_size=1, stdout=StringIO())
+        self.assertEqual(self.found('индекс'), [post.pk])
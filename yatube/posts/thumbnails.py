@@ -0,0 +1,205 @@
+"""Заблаговременное создание миниатюр картинок статей.
+
+Шаблоны выводят миниатюры тегом {% thumbnail %}, который создаёт их при
+первом показе. Чтобы за это не платил первый читатель, после сохранения
+картинки все варианты (variants) не шире исходной картинки создаются в
+фоновом пуле потоков, после чего закешированные карточки статей с этой
+картинкой сбрасываются, чтобы получить srcset. Команда
+rebuild_thumbnails делает то же для всех картинок сразу.
+
+Варианты — это ширины POST_THUMBNAIL_WIDTHS для srcset в формате sorl по
+умолчанию и, если Pillow собран с поддержкой WebP, те же ширины в WebP.
+
+Тег {% thumbnail %} ищет каждую миниатюру в хранилище sorl отдельно,
+поэтому attach находит миниатюры лент для всей страницы одним
+get_many к кешу и одним запросом к базе для промахов кеша.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from PIL import features
+from sorl.thumbnail import default, delete, get_thumbnail
+from sorl.thumbnail.conf import (
+    defaults as sorl_defaults, settings as sorl_settings)
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    EMPTY_VALUE, KVStore as CachedDBKVStore)
+from sorl.thumbnail.models import KVStore
+
+from core.cache import bump_versions
+
+from .cards import card_namespace
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def variants():
+    """Тройки (ширина, размер, параметры) всех миниатюр статьи."""
+    aspect_width, aspect_height = settings.POST_THUMBNAIL_ASPECT
+    formats = [None]
+    if features.check('webp'):
+        formats.append('WEBP')
+    result = []
+    for image_format in formats:
+        for width in settings.POST_THUMBNAIL_WIDTHS:
+            options = dict(settings.POST_THUMBNAIL_OPTIONS)
+            if image_format is not None:
+                options['format'] = image_format
+            height = round(width * aspect_height / aspect_width)
+            result.append((width, f'{width}x{height}', options))
+    return result
+
+
+def max_variant_width(image_width, main_width):
+    """Самая широкая нужная миниатюра: первая ширина есть всегда."""
+    return max(image_width or main_width, main_width)
+
+
+def generate(name, force=False):
+    """Создаёт миниатюры картинки name, уже готовые пропускает."""
+    source = ImageFile(name, Post._meta.get_field('image').storage)
+    if force:
+        delete(source, delete_file=False)
+    posts = list(
+        Post.objects.filter(image=name).values_list('pk', 'image_width')
+    )
+    all_variants = variants()
+    max_width = max_variant_width(
+        max((width or 0 for _, width in posts), default=0),
+        all_variants[0][0],
+    )
+    for width, geometry, options in all_variants:
+        if width <= max_width:
+            get_thumbnail(source, geometry, **options)
+    if posts:
+        bump_versions(*(card_namespace('post', pk) for pk, _ in posts))
+
+
+def _generate_logged(name):
+    try:
+        generate(name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+
+
+def _generate_in_background(name):
+    try:
+        _generate_logged(name)
+    finally:
+        # Поток пула сам открывает соединение с базой для хранилища sorl.
+        connections.close_all()
+
+
+def _submit(name):
+    if settings.THUMBNAIL_WORKERS:
+        executor().submit(_generate_in_background, name)
+    else:
+        _generate_logged(name)
+
+
+def schedule(name):
+    """Создаёт миниатюры в фоне после фиксации текущей транзакции."""
+    if name:
+        transaction.on_commit(lambda: _submit(name))
+
+
+def thumbnail_key(source, geometry, options):
+    """Ключ миниатюры в хранилище sorl, как его строит get_thumbnail."""
+    backend = default.backend
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return add_prefix(ImageFile(name, default.storage).key)
+
+
+def lookup(keys):
+    """Сериализованные миниатюры по ключам: кеш, затем база."""
+    kvstore = default.kvstore
+    if not isinstance(kvstore, CachedDBKVStore):
+        return {
+            key: value for key, value in
+            ((key, kvstore._get_raw(key)) for key in keys) if value
+        }
+    found = kvstore.cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        from_db = dict(
+            KVStore.objects.filter(key__in=missing)
+            .values_list('key', 'value')
+        )
+        kvstore.cache.set_many(
+            from_db, sorl_settings.THUMBNAIL_CACHE_TIMEOUT
+        )
+        found.update(from_db)
+    return {
+        key: value for key, value in found.items()
+        if value and value != EMPTY_VALUE
+    }
+
+
+def srcset(images):
+    return ', '.join(f'{image.url} {width}w' for width, image in images)
+
+
+def attach(posts):
+    """Добавляет статьям миниатюры, найденные в хранилище sorl.
+
+    thumbnail — миниатюра первой ширины или None, тогда шаблон создаст её
+    тегом {% thumbnail %}. srcset и webp_srcset — найденные ширины, не
+    больше ширины исходной картинки, если она известна.
+    """
+    all_variants = variants()
+    keys = {}
+    for post in posts:
+        if not post.image:
+            continue
+        source = ImageFile(post.image)
+        keys[post.pk] = [
+            thumbnail_key(source, geometry, options)
+            for _, geometry, options in all_variants
+        ]
+    found = lookup(
+        [key for post_keys in keys.values() for key in post_keys]
+    ) if keys else {}
+    main_width = all_variants[0][0]
+    for post in posts:
+        post.thumbnail, post.srcset, post.webp_srcset = None, '', ''
+        values = [found.get(key) for key in keys.get(post.pk, ())]
+        if not values or values[0] is None:
+            continue
+        post.thumbnail = deserialize_image_file(values[0])
+        max_width = max_variant_width(post.image_width, main_width)
+        images = {None: [], 'WEBP': []}
+        for (width, _, options), value in zip(all_variants, values):
+            if value is not None and width <= max_width:
+                images[options.get('format')].append(
+                    (width, deserialize_image_file(value))
+                )
+        post.srcset = srcset(sorted(images[None]))
+        post.webp_srcset = srcset(sorted(images['WEBP']))
@@ -0,0 +1,249 @@
+"""Материализованная лента подписок (fan-out on write).
+
+Новая статья раскладывается по лентам подписчиков автора при сохранении.
+Для авторов, у которых подписчиков больше FOLLOW_FANOUT_THRESHOLD, раскладка
+пропускается, и их статьи подмешиваются в ленту при чтении. Момент
+перехода порога запоминается в UserStats.celebrity_since.
+
+Когда после отписки автор опускается до порога, его статьи с
+celebrity_since раскладываются по лентам подписчиков в фоновом потоке,
+порциями в коротких транзакциях. Пока раскладка не закончилась,
+celebrity_since не сброшен, и статьи автора по-прежнему подмешиваются при
+чтении. Новый подписчик получает в ленту все статьи автора сразу.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core import writes
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginators import CursorPaginator
+
+logger = logging.getLogger(__name__)
+
+
+BATCH_SIZE = 500
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def fanout_threshold():
+    return getattr(settings, 'FOLLOW_FANOUT_THRESHOLD', 1000)
+
+
+def is_celebrity(author_id):
+    return UserStats.objects.filter(
+        pk=author_id, followers_count__gt=fanout_threshold()
+    ).exists()
+
+
+def celebrities(author_ids):
+    """Авторы, чьи статьи подмешиваются в ленту при чтении."""
+    return list(
+        UserStats.objects.filter(
+            Q(followers_count__gt=fanout_threshold())
+            | Q(celebrity_since__isnull=False),
+            pk__in=author_ids,
+        ).values_list('pk', flat=True)
+    ) if author_ids else []
+
+
+def mark_celebrity(author_id):
+    """Запоминает момент, когда подписчиков стало больше порога."""
+    UserStats.objects.filter(
+        pk=author_id,
+        followers_count__gt=fanout_threshold(),
+        celebrity_since__isnull=True,
+    ).update(celebrity_since=timezone.now())
+
+
+def fan_out_post(post):
+    """Добавляет статью в ленты подписчиков автора."""
+    if is_celebrity(post.author_id):
+        return
+    followers = (
+        Follow.objects.filter(author_id=post.author_id)
+        .values_list('user_id', flat=True).iterator(chunk_size=BATCH_SIZE)
+    )
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(
+            user_id=user_id,
+            post=post,
+            author_id=post.author_id,
+            pub_date=post.pub_date,
+        ) for user_id in followers),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(follow):
+    """Заполняет ленту нового подписчика статьями автора.
+
+    Для популярного автора тоже: иначе его статьи до ухода под порог
+    пропали бы из ленты, а restore_fan_out раскладывает только новые.
+    """
+    posts = (
+        Post.objects.filter(author_id=follow.author_id)
+        .values_list('pk', 'pub_date').iterator(chunk_size=BATCH_SIZE)
+    )
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(
+            user_id=follow.user_id,
+            post_id=post_id,
+            author_id=follow.author_id,
+            pub_date=pub_date,
+        ) for post_id, pub_date in posts),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def needs_restore(author_id):
+    return UserStats.objects.filter(
+        pk=author_id,
+        followers_count__lte=fanout_threshold(),
+        celebrity_since__isnull=False,
+    ).exists()
+
+
+def restore_fan_out(author_id):
+    """Раскладывает статьи автора, опустившегося до порога, по лентам.
+
+    Раскладываются только статьи с celebrity_since, более ранние уже в
+    лентах. Каждые BATCH_SIZE записей пишутся своей транзакцией, а
+    celebrity_since сбрасывается последним.
+    """
+    since = UserStats.objects.filter(
+        pk=author_id,
+        followers_count__lte=fanout_threshold(),
+        celebrity_since__isnull=False,
+    ).values_list('celebrity_since', flat=True).first()
+    if since is None:
+        return
+    followers = list(
+        Follow.objects.filter(author_id=author_id)
+        .values_list('user_id', flat=True)
+    )
+    posts = list(
+        Post.objects.filter(author_id=author_id, pub_date__gte=since)
+        .values_list('pk', 'pub_date')
+    )
+    entries = (
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post_id,
+            author_id=author_id,
+            pub_date=pub_date,
+        ) for post_id, pub_date in posts for user_id in followers
+    )
+    while True:
+        batch = list(islice(entries, BATCH_SIZE))
+        if not batch:
+            break
+        writes.run(
+            TimelineEntry.objects.bulk_create, batch, ignore_conflicts=True
+        )
+    writes.run(
+        UserStats.objects.filter(
+            pk=author_id,
+            followers_count__lte=fanout_threshold(),
+            celebrity_since=since,
+        ).update,
+        celebrity_since=None,
+    )
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TIMELINE_WORKERS,
+                thread_name_prefix='timeline',
+            )
+        return _executor
+
+
+def _restore_logged(author_id):
+    try:
+        restore_fan_out(author_id)
+    except Exception:
+        logger.exception('Не удалось разложить статьи автора %s', author_id)
+
+
+def _restore_in_background(author_id):
+    try:
+        _restore_logged(author_id)
+    finally:
+        connections.close_all()
+
+
+def _submit(author_id):
+    if settings.TIMELINE_WORKERS:
+        executor().submit(_restore_in_background, author_id)
+    else:
+        _restore_logged(author_id)
+
+
+def schedule_restore(author_id):
+    """Ставит restore_fan_out в очередь после фиксации счётчиков."""
+    if needs_restore(author_id):
+        transaction.on_commit(lambda: _submit(author_id))
+
+
+def prune(follow):
+    """Убирает статьи автора из ленты отписавшегося пользователя."""
+    TimelineEntry.objects.filter(
+        user_id=follow.user_id, author_id=follow.author_id
+    ).delete()
+
+
+class TimelinePaginator(CursorPaginator):
+    """Лента подписок пользователя: записи ленты и статьи популярных авторов.
+
+    Курсорная страница берётся из TimelineEntry по индексу
+    (user, -pub_date, -post) вместе со статьями, а статьи каждого
+    популярного автора — по индексу (author, -pub_date, -id). Обе выборки
+    останавливаются на LIMIT и сливаются по ключу (pub_date, pk). Старые
+    ссылки ?page=N листают общий запрос по статьям.
+    """
+    related = ('author', 'group')
+
+    def __init__(self, user, per_page, **kwargs):
+        self.entries = TimelineEntry.objects.filter(user=user).select_related(
+            *(f'post__{name}' for name in self.related)
+        )
+        # Подписки могут быть в другой базе (core.hot), поэтому сначала id
+        # авторов, потом их счётчики.
+        self.celebrities = celebrities(list(
+            Follow.objects.filter(user=user)
+            .values_list('author_id', flat=True)
+        ))
+        self.posts = Post.objects.select_related(*self.related)
+        condition = Q(pk__in=self.entries.values('post_id'))
+        if self.celebrities:
+            condition |= Q(author_id__in=self.celebrities)
+        super().__init__(self.posts.filter(condition), per_page, **kwargs)
+
+    def fetch(self, after, before, limit):
+        entries = self.seek(self.entries, after, before, pk_field='post_id')
+        found = {entry.post_id: entry.post for entry in entries[:limit]}
+        for author_id in self.celebrities:
+            posts = self.seek(
+                self.posts.filter(author_id=author_id), after, before
+            )
+            found.update((post.pk, post) for post in posts[:limit])
+        posts = sorted(
+            found.values(), key=lambda post: (post.pub_date, post.pk),
+            reverse=before is None,
+        )
+        return posts[:limit]
@@ -0,0 +1,168 @@
+"""Загрузка картинок по частям с возможностью продолжить.
+
+    POST /uploads/ (filename, size)      -> 201 {"id", "offset": 0}
+    POST /uploads/<id>/ + Content-Range  -> {"id", "offset", "complete"}
+    GET  /uploads/<id>/                  -> {"id", "offset", "complete"}
+
+Части пишутся в файл в .incoming хранилища картинок. Часть с началом не
+там, где остановилась загрузка, отклоняется с 409 и текущим offset, так
+что клиент после обрыва спрашивает offset и продолжает с него. Форма
+статьи вместо файла передаёт upload_id завершённой загрузки (with_upload),
+и файл проходит ту же проверку, что и обычная загрузка.
+"""
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+from django.core.files.uploadedfile import UploadedFile
+
+from core import writes
+from core.storage import INCOMING_DIR
+
+from .models import Post, Upload
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+COPY_BUFFER = 64 * 1024
+
+
+class OffsetMismatch(Exception):
+    pass
+
+
+def status(upload):
+    return {
+        'id': str(upload.pk),
+        'offset': upload.offset,
+        'complete': upload.complete,
+    }
+
+
+def part_path(upload):
+    storage = Post._meta.get_field('image').storage
+    return storage.path(f'{INCOMING_DIR}/upload-{upload.pk}.part')
+
+
+def start(user, filename, size):
+    upload = Upload.objects.create(
+        user=user, filename=os.path.basename(filename), size=size
+    )
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return upload
+
+
+def parse_content_range(header):
+    """(начало, конец включительно, всего) или None."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if match is None:
+        return None
+    first, last, total = map(int, match.groups())
+    if first > last or last >= total:
+        return None
+    return first, last, total
+
+
+def copy_chunk(stream, target, length):
+    """Копирует до length байт из stream, возвращает число скопированных."""
+    written = 0
+    while written < length:
+        chunk = stream.read(min(COPY_BUFFER, length - written))
+        if not chunk:
+            break
+        target.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def append(upload, stream, first, length):
+    """Дописывает length байт из stream, если first совпадает с offset.
+
+    Часть сначала читается во временный файл. Затем UPDATE с условием
+    offset = first забирает диапазон, и в той же транзакции часть
+    переносится в файл загрузки. Параллельный повтор той же части
+    получает OffsetMismatch и файла не касается.
+    """
+    if first != upload.offset:
+        raise OffsetMismatch
+    path = part_path(upload)
+    with tempfile.TemporaryFile(dir=os.path.dirname(path)) as chunk:
+        written = copy_chunk(stream, chunk, length)
+
+        def claim():
+            claimed = Upload.objects.filter(
+                pk=upload.pk, offset=first
+            ).update(offset=first + written)
+            if not claimed:
+                raise OffsetMismatch
+            chunk.seek(0)
+            with open(path, 'r+b') as part:
+                part.seek(first)
+                shutil.copyfileobj(chunk, part, COPY_BUFFER)
+                part.truncate()
+        writes.run(claim)
+    upload.offset = first + written
+    return upload
+
+
+def discard(upload):
+    """Удаляет загрузку и её файл."""
+    part = getattr(upload, 'part', None)
+    if part is not None:
+        part.close()
+    try:
+        os.unlink(part_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+class UploadedPart(UploadedFile):
+    """Файл завершённой загрузки.
+
+    Как и у TemporaryUploadedFile, у него есть temporary_file_path, так
+    что forms.ImageField открывает файл по пути, а не читает его в память.
+    """
+    def temporary_file_path(self):
+        return self.file.name
+
+
+@contextmanager
+def with_upload(request):
+    """request.FILES с картинкой из завершённой загрузки upload_id.
+
+    Отдаёт также загрузку, которую надо удалить (discard) после
+    сохранения статьи, или None. Файл загрузки закрывается на выходе, даже
+    если форма не прошла проверку.
+    """
+    upload_id = request.POST.get('upload_id')
+    if not upload_id or 'image' in request.FILES:
+        yield request.FILES, None
+        return
+    try:
+        upload = Upload.objects.get(
+            pk=uuid.UUID(upload_id), user=request.user
+        )
+    except (ValueError, Upload.DoesNotExist):
+        yield request.FILES, None
+        return
+    if not upload.complete:
+        yield request.FILES, None
+        return
+    try:
+        part = open(part_path(upload), 'rb')
+    except FileNotFoundError:
+        # Файл давно брошенной загрузки убрал collect_media_garbage.
+        yield request.FILES, None
+        return
+    with part:
+        upload.part = UploadedPart(
+            part, name=upload.filename, size=upload.size
+        )
+        files = request.FILES.copy()
+        files['image'] = upload.part
+        yield files, upload
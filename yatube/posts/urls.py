@@ -12,7 +12,14 @@ urlpatterns = [
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
+    path('uploads/', views.upload_create, name='upload_create'),
+    path(
+        'uploads/<uuid:upload_id>/',
+        views.upload_chunk,
+        name='upload_chunk'
+    ),
     path('posts/<int:post_id>/comment', views.add_comment, name='add_comment'),
+    path('search/', views.search, name='search'),
     path('follow/', views.follow_index, name='follow_index'),
     path(
         'profile/<str:username>/follow/',
@@ -1,67 +1,110 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import router, transaction
+from django.http import HttpResponseNotAllowed, JsonResponse
 from django.shortcuts import (
     render, redirect, get_object_or_404, get_list_or_404)
 
-from django.views.decorators.cache import cache_page
+from core import replica, writes
+from core.cache import versioned_cache_page
 
+from . import thumbnails, timeline, uploads
+from .cards import attach_card_versions
 from .forms import PostForm, CommentForm
 
-from .models import Follow, Post, Group, User, Comment
+from .models import Follow, Post, Group, User, Comment, Upload
+from .paginators import CursorPaginator, ElidedPaginator, feed_count_key
+from .search import SearchResults
 
 
 namespace = 'posts'
 
+POSTS_PER_PAGE = 10
+
+
+def paginate(request, post_list, count_key=None, count=None):
+    return paginator_page(request, CursorPaginator(
+        post_list, POSTS_PER_PAGE, count_key=count_key, count=count
+    ))
+
 
-def paginate(request, post_list):
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+def paginator_page(request, paginator):
+    if 'page' in request.GET:
+        page_obj = paginator.get_page(request.GET.get('page'))
+    else:
+        page_obj = paginator.get_cursor_page(
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+        )
+    attach_card_versions(page_obj)
+    thumbnails.attach(page_obj)
     return page_obj
 
 
-@cache_page(20, key_prefix='index_page')
+def attach_authors(objects):
+    """Авторы одним запросом без JOIN: объекты могут быть в другой базе."""
+    authors = User.objects.in_bulk({obj.author_id for obj in objects})
+    for obj in objects:
+        if obj.author_id in authors:
+            obj.author = authors[obj.author_id]
+
+
+@versioned_cache_page(lambda: ['index'], holes=True)
 def index(request):
     template = 'posts/index.html'
-    post_list = Post.objects.all()
+    post_list = Post.objects.select_related('author', 'group')
     context = {
-        'page_obj': paginate(request, post_list),
+        'page_obj': paginate(request, post_list, feed_count_key('all')),
     }
     return render(request, template, context)
 
 
+@versioned_cache_page(lambda slug: [f'group:{slug}'], holes=True)
 def group_posts(request, slug):
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
+    post_list = group.posts.select_related('author', 'group')
     context = {
-        'page_obj': paginate(request, post_list),
+        'page_obj': paginate(request, post_list, count=group.posts_count),
     }
     return render(request, template, context)
 
 
+@versioned_cache_page(
+    lambda username: [f'profile:{username}'], holes=True
+)
 def profile(request, username):
     template = 'posts/profile.html'
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    post_list = author.posts.select_related('author', 'group')
+    stats = getattr(author, 'stats', None)
+    posts_count = stats.posts_count if stats else None
     # post_list = Post.objects.filter(author__username = username)
-    following = (request.user.is_authenticated 
-        and request.user != author and Follow.objects.filter(
-            user=request.user, author__username=username).exists())
     context = {
         'author': author,
-        'page_obj': paginate(request, post_list),
-        'following': following
+        'page_obj': paginate(request, post_list, count=posts_count),
     }
     return render(request, template, context)
 
 
+# Число статей автора на странице поста может отставать до
+# PAGE_CACHE_SOFT_TIMEOUT: оно меняется без изменения самого поста.
+@versioned_cache_page(lambda post_id: [f'post:{post_id}'], holes=True)
 def post_detail(request, post_id):
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group')
+        .prefetch_related('comments'),
+        pk=post_id,
+    )
+    attach_authors(post.comments.all())
+    thumbnails.attach([post])
     context = {
         'post': post,
-        'form': CommentForm(request.POST or None),
     }
     return render(request, template, context)
 
@@ -70,30 +113,41 @@ def post_detail(request, post_id):
 def post_create(request):
     template = 'posts/create_post.html'
     if request.method == 'POST':
-        form = PostForm(request.POST or None, request.FILES or None)
-        if form.is_valid():
-            new_post = form.save(commit=False)
-            new_post.author = request.user
-            new_post.save()
-            return redirect('posts:profile', request.user)
+        with uploads.with_upload(request) as (files, upload):
+            form = PostForm(request.POST or None, files or None)
+            if form.is_valid():
+                new_post = form.save(commit=False)
+                new_post.author = request.user
+                writes.run(new_post.save)
+                thumbnails.schedule(new_post.image.name)
+                if upload is not None:
+                    uploads.discard(upload)
+                return redirect('posts:profile', request.user)
         return render(request, template, {'form': form})
     form = PostForm()
     return render(request, template, {'form': form})
 
 
 @login_required
+@replica.use_primary
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     if post.author != request.user:
         return redirect('posts:post_detail', post_id=post_id)
-    form = PostForm(
-        request.POST or None,
-        files=request.FILES or None,
-        instance=post
-    )
-    if form.is_valid():
-        form.save()
-        return redirect('posts:post_detail', post_id=post_id)
+    with uploads.with_upload(request) as (files, upload):
+        form = PostForm(
+            request.POST or None,
+            files=files or None,
+            instance=post
+        )
+        if form.is_valid():
+            with transaction.atomic():
+                post = form.save()
+                if 'image' in form.changed_data:
+                    thumbnails.schedule(post.image.name)
+            if upload is not None:
+                uploads.discard(upload)
+            return redirect('posts:post_detail', post_id=post_id)
     context = {
         'form': form,
         'is_edit': True,
@@ -101,6 +155,46 @@ def post_edit(request, post_id):
     return render(request, 'posts/create_post.html', context)
 
 
+@login_required
+def upload_create(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    filename = request.POST.get('filename', '')
+    size = request.POST.get('size', '')
+    if not filename or not size.isdigit() or int(size) == 0:
+        return JsonResponse({'error': 'Нужны filename и size'}, status=400)
+    if int(size) > settings.POST_IMAGE_MAX_BYTES:
+        return JsonResponse({'error': 'Файл слишком большой'}, status=413)
+    upload = uploads.start(request.user, filename, int(size))
+    return JsonResponse(uploads.status(upload), status=201)
+
+
+@login_required
+@replica.use_primary
+def upload_chunk(request, upload_id):
+    upload = get_object_or_404(Upload, pk=upload_id, user=request.user)
+    if request.method == 'GET':
+        return JsonResponse(uploads.status(upload))
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['GET', 'POST'])
+    content_range = uploads.parse_content_range(
+        request.META.get('HTTP_CONTENT_RANGE')
+    )
+    if content_range is None or content_range[2] != upload.size:
+        return JsonResponse(
+            {'error': 'Нужен Content-Range в пределах файла'}, status=400
+        )
+    first, last, _ = content_range
+    if last - first + 1 > settings.UPLOAD_CHUNK_MAX_BYTES:
+        return JsonResponse({'error': 'Часть слишком большая'}, status=413)
+    try:
+        upload = uploads.append(upload, request, first, last - first + 1)
+    except uploads.OffsetMismatch:
+        upload.refresh_from_db()
+        return JsonResponse(uploads.status(upload), status=409)
+    return JsonResponse(uploads.status(upload))
+
+
 @login_required
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
@@ -109,15 +203,29 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        writes.run(comment.save, using=router.db_for_write(Comment))
     return redirect('posts:post_detail', post_id=post_id)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    paginator = ElidedPaginator(SearchResults(query), POSTS_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    attach_card_versions(page_obj)
+    thumbnails.attach(page_obj)
+    context = {
+        'query': query,
+        'page_query': urlencode({'q': query}) + '&',
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
+    paginator = timeline.TimelinePaginator(request.user, POSTS_PER_PAGE)
     context = {
-        'page_obj': paginate(request, post_list),
+        'page_obj': paginator_page(request, paginator),
     }
     return render(request, 'posts/follow.html', context)
 
@@ -126,15 +234,17 @@ def follow_index(request):
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if author != request.user:
-        Follow.objects.get_or_create(
-            user=request.user, author=author
+        writes.run(
+            Follow.objects.get_or_create, user=request.user, author=author,
+            using=router.db_for_write(Follow),
         )
     return redirect('posts:profile', username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    get_object_or_404(
-        Follow, user=request.user, author__username=username
-    ).delete()
+    author = get_object_or_404(User, username=username)
+    follow = get_object_or_404(Follow, user=request.user, author=author)
+    with transaction.atomic(using=router.db_for_write(Follow)):
+        follow.delete()
     return redirect('posts:profile', username)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref//
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -100,10 +101,43 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # SQLite в режиме WAL и с PRAGMA из core.db_backend.base.PRAGMAS.
+        'ENGINE': 'core.db_backend',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 600)),
     }
 }
+# Записи через core.writes.run повторяются при «database is locked» не
+# больше WRITE_RETRIES раз; пауза растёт от WRITE_BACKOFF вдвое, но не
+# дольше WRITE_BACKOFF_MAX секунд.
+WRITE_RETRIES = 5
+WRITE_BACKOFF = 0.05
+WRITE_BACKOFF_MAX = 1
+# Реплика для чтения статей и лент (core.replica), включается путём к
+# файлу в DJANGO_READ_REPLICA. Обновляется командой refresh_replica.
+REPLICA_DATABASE = 'replica'
+REPLICA_APPS = ['posts']
+REPLICA_STICKY_SECONDS = 30
+DATABASE_ROUTERS = []
+if os.environ.get('DJANGO_READ_REPLICA'):
+    DATABASES[REPLICA_DATABASE] = {
+        **DATABASES['default'],
+        'NAME': os.environ['DJANGO_READ_REPLICA'],
+        'OPTIONS': {'pragmas': {'query_only': 1}},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS.append('core.replica.ReplicaRouter')
+    MIDDLEWARE.append('core.replica.ReplicaMiddleware')
+# Отдельная база для комментариев и подписок (core.hot), включается путём
+# к файлу в DJANGO_HOT_DATABASE. Её роутер идёт раньше роутера реплики.
+HOT_DATABASE = 'hot'
+HOT_MODELS = ['posts.comment', 'posts.follow']
+if os.environ.get('DJANGO_HOT_DATABASE'):
+    DATABASES[HOT_DATABASE] = {
+        **DATABASES['default'],
+        'NAME': os.environ['DJANGO_HOT_DATABASE'],
+    }
+    DATABASE_ROUTERS.insert(0, 'core.hot.HotTablesRouter')
 
 
 # Password validation
@@ -151,8 +185,66 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Без DEBUG файлы из MEDIA_ROOT отдаёт core.media.serve. Имена под этими
+# префиксами — хеши содержимого, такие файлы кешируются навсегда.
+MEDIA_IMMUTABLE_PREFIXES = ['posts/', 'cache/']
+MEDIA_CACHE_MAX_AGE = 60 * 60
+# Внутренний location nginx (например, '/protected-media/'), которому
+# передаётся отдача файла через X-Accel-Redirect.
+MEDIA_ACCEL_REDIRECT = os.environ.get('DJANGO_MEDIA_ACCEL_REDIRECT')
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
+if not DEBUG:
+    # Общий для воркеров кеш: L1 в памяти процесса, L2 в файле SQLite.
+    CACHES['default'] = {
+        'BACKEND': 'core.cache_backends.TwoTierCache',
+        'LOCATION': os.environ.get(
+            'DJANGO_CACHE_PATH',
+            os.path.join(tempfile.gettempdir(), 'yatube-cache.sqlite3'),
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'L1_TIMEOUT': 5,
+            'POLL_INTERVAL': 0.5,
+        },
+    }
+# Авторы с большим числом подписчиков не раскладываются по лентам
+# при публикации, их статьи подмешиваются в ленту при чтении.
+FOLLOW_FANOUT_THRESHOLD = 1000
+# Сколько потоков процесса раскладывают статьи автора, ушедшего под порог.
+# При 0 раскладка идёт сразу после фиксации отписки, в том же запросе.
+TIMELINE_WORKERS = 1
+# Как долго (в секундах) живут закешированные счётчики статей лент.
+FEED_COUNT_TIMEOUT = 300
+# Страницы для анонимных пользователей сбрасываются сигналами при
+# изменении данных, поэтому могут жить в кеше долго.
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# Через сколько секунд страница считается устаревшей и пересчитывается
+# одним запросом, пока остальные получают старую копию.
+PAGE_CACHE_SOFT_TIMEOUT = 60 * 10
+# Сколько секунд держится блокировка пересчёта страницы.
+PAGE_CACHE_LOCK_TIMEOUT = 10
+# Миниатюры статей создаются заранее при загрузке картинки. Ширины идут
+# в srcset, первая выводится в src; высота следует из пропорций.
+POST_THUMBNAIL_WIDTHS = [960, 480, 1440]
+POST_THUMBNAIL_ASPECT = (960, 339)
+POST_THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+# Сколько потоков процесса создают миниатюры в фоне. При 0 миниатюры
+# создаются сразу после сохранения статьи, в том же запросе.
+THUMBNAIL_WORKERS = 2
+# Загрузки всегда пишутся во временный файл, а не в память.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Ограничения картинок статей: больше POST_IMAGE_MAX_BYTES или
+# POST_IMAGE_MAX_PIXELS отклоняются, стороны длиннее POST_IMAGE_MAX_SIDE
+# уменьшаются.
+POST_IMAGE_MAX_BYTES = 20 * 2 ** 20
+POST_IMAGE_MAX_PIXELS = 50 * 10 ** 6
+POST_IMAGE_MAX_SIDE = 2560
+POST_IMAGE_JPEG_QUALITY = 85
+# Наибольшая часть загрузки по частям, в байтах.
+UPLOAD_CHUNK_MAX_BYTES = 5 * 2 ** 20